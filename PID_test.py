@@ -1,43 +1,21 @@
-from smbus import SMBus   # pmbus command library
+import argparse
 import sys
+from collections import deque
 import time
 import csv
 from datetime import datetime
 import threading
+from contextlib import nullcontext
 import numpy as np
 import larpix_monitor_vac_pressure as lmp
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from matplotlib.lines import Line2D
+from supper_supp_modules import power_supply
+# matplotlib and the scope modules are imported where they are used, so
+# the control loop can run headless without loading matplotlib
 
 def read_temps():
     temperatures = lmp.read_tempers()
     return temperatures
     
-class power_supply:
-
-    def __init__(self, addr, id=1):
-        self.bus = SMBus(id)
-        self.address = addr
-
-    def set_page(self, page):
-        if page not in self.valid_pages:
-            raise ValueError(f"Invalid module page {page}.")
-        self.bus.write_byte_data(self.address, 0x00, page)
-
-    def set_voltage(self, page, voltage):                    #sets output voltage
-        self.set_page(page)	
-        exp = -8                                   #exponent typically used in CoolX series, pg 14 of manual, and exp value can be found using VOUT_MODE command
-        vout_command = int(voltage * (2 ** -exp))  #converts voltage to format for PMBus
-        self.bus.write_word_data(self.address, 0x21, vout_command)  #sends 16-bit voltage command to vout command (0x21)
-
-    def read_power(self, page):
-        self.set_page(page)
-        voltage = self.read_voltage(page)
-        current = self.read_current(page)
-        power = current * voltage
-        return power
-         
 class PID:
 
     def __init__(self, Kp=1.0, Ki=1.0, Kd=1.0, setpoint=488, sample_time = 1.0, output_limits=(0, 100), auto_mode=True, proportional_on_measurement=False, differential_on_measurement=True, error_map=None, time_fn=None, starting_output=0.0):
@@ -70,7 +48,7 @@ class PID:
         self.integral += error
         integral = self.Ki * self.integral
         #derivative term
-        derivative = self.Kd * (error - self.last_error)
+        derivative = 0 if self.last_error is None else self.Kd * (error - self.last_error)
         #PID control output
         output = proportional + integral + derivative
         output = max(self.output_limits[0], min(output, self.output_limits[1]))
@@ -78,39 +56,6 @@ class PID:
         self.last_error = error
         return output
     
-class Scope():
-    def __init__(self, ax, maxt=10, dt=0.1, modules=3, title="Power of Modules", ylabel="Power (W)", legend_prefix="Module", ylim=(0,100)):
-        self.ax = ax
-        self.dt = dt
-        self.maxt = maxt
-        self.modules = modules
-        self.tdata = np.array([])
-        self.ydatas = [np.array([]) for _ in [1,2,4]]  
-        self.t0 = time.perf_counter()
-        self.colors = ['r', 'g', 'm', 'b']
-        self.lines = [Line2D([], [], color=self.colors[i], label=f'{legend_prefix} {i+1}') for i in [1,2,4]]
-        for line in self.lines:
-            self.ax.add_line(line)
-        self.ax.set_ylim(ylim)  
-        self.ax.set_xlim(0, self.maxt)
-        self.ax.set_title(title)
-        self.ax.set_xlabel("Time (s)")
-        self.ax.set_ylabel(ylabel)
-        self.ax.legend(loc='upper left')
-
-    def update(self, data):
-        t, values = data
-        self.tdata = np.append(self.tdata, t)
-        time_filter = self.tdata > (t - self.maxt)
-        self.tdata = self.tdata[time_filter]
-        for i, value in enumerate(values):
-            self.ydatas[i] = np.append(self.ydatas[i], value)
-            self.ydatas[i] = self.ydatas[i][time_filter]   
-        for i, line in enumerate(self.lines):
-            line.set_data(self.tdata, self.ydatas[i])
-        self.ax.set_xlim(self.tdata[0], self.tdata[0] + self.maxt)
-        self.ax.figure.canvas.draw()
-        return self.lines
 '''
 #Emitter function for plotting power and temperature values
 def emitter_power(pid_controllers, power_supply, modules=3):
@@ -125,46 +70,164 @@ def emitter_power(pid_controllers, power_supply, modules=3):
             powers.append(power)  # Collect power values for each module
         yield t, powers'''
 
-def emitter_power():
-    start_time = time.perf_counter()
-    while True:
-        t = time.perf_counter() - start_time
-     #   powers = [power_supply.read_power(page=i + 1) for i in ]  #reads power from 3 modules
-        powers = [power_supply.read_power(page=4)]
-        yield t, powers        
-        
-def emitter_temp():
-    start_time = time.perf_counter()
+#Acquisition and control on their own thread: the only user of the buses.
+#Every sample_dt it takes a snapshot of the modules and reads the RTDs; every
+#control_dt it runs the PID step and sets the voltage. Timestamped samples
+#(seconds since start, values) go into bounded deques that the animations
+#drain, so a slow bus read never stalls the GUI and the control timing does
+#not depend on the frame rate. If nobody drains them the oldest samples are
+#dropped
+class ControlWorker:
+    def __init__(self, power_supp, pid_controllers, pages=(4,), control_dt=1.0, sample_dt=0.1, maxlen=10000, read_temps=read_temps, metrics=None):
+        self.power_supp = power_supp
+        self.metrics = metrics      #metrics_exporter.MetricsCache behind a /metrics endpoint
+        self.read_temps = read_temps
+        self.pid_controllers = pid_controllers
+        self.pages = list(pages)
+        self.control_dt = control_dt
+        self.sample_dt = sample_dt
+        self.power_samples = deque(maxlen=maxlen)
+        self.temp_samples = deque(maxlen=maxlen)
+        self.errors = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='control-worker', daemon=True)
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.thread.join(timeout)
+
+    def timed(self, op):
+        #time a bus read for the metrics endpoint, if there is one
+        return self.metrics.timed(op) if self.metrics is not None else nullcontext()
+
+    def control_step(self, temps):
+        #only the 4th RTD drives a module (4) for now
+        current_temp = temps[3]
+        power = self.pid_controllers[3].update(current_temp)
+        self.power_supp.set_voltage(4, power)
+
+    def _run(self):
+        next_sample = next_control = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                #one snapshot per module: t is taken from the snapshot
+                with self.timed('snapshot_all'):
+                    snaps = self.power_supp.snapshot_all(self.pages)
+                self.power_samples.append((snaps[-1].t - self.start_time, [snap.power for snap in snaps]))
+                with self.timed('read_tempers'):
+                    temps = self.read_temps()
+                self.temp_samples.append((time.monotonic() - self.start_time, temps))
+                if self.metrics is not None:
+                    for snap in snaps:
+                        self.metrics.publish_snapshot(snap)
+                    self.metrics.publish_tempers(temps)
+                if time.monotonic() >= next_control:
+                    self.control_step(temps)
+                    next_control += self.control_dt
+                    if next_control < time.monotonic():   #fell behind: do not try to catch up
+                        next_control = time.monotonic() + self.control_dt
+            except Exception as e:
+                #a bus error, ADC timeout or bad daemon response: count it and
+                #try again next cycle rather than let the thread die silently
+                self.errors += 1
+                print(f"Acquisition error ({self.errors}): {type(e).__name__}: {e}")
+            next_sample += self.sample_dt
+            self.stop_event.wait(max(next_sample - time.monotonic(), 0))
+            if next_sample < time.monotonic():
+                next_sample = time.monotonic()
+
+#Animation source: once per frame, everything published since the last frame
+#as one batch (ts, values[n, channels])
+def emitter(samples, channels):
     while True:
-        t = time.perf_counter() - start_time
-        temps = read_temps()  #Directly get the current temperatures from RTDs
-        yield t, temps
+        batch = []
+        while True:
+            try:
+                batch.append(samples.popleft())
+            except IndexError:
+                break
+        ts = np.array([t for t, values in batch])
+        yield ts, np.array([values for t, values in batch], dtype=float).reshape(len(batch), channels)
 
 #Main function to manage PID control, real-time plotting of power, and temperature
-def main():
-    addr = 0x50
-    power_supp = power_supply(addr)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='PID control of the modules from the RTD temperatures')
+    parser.add_argument('--headless', action='store_true',
+                        help='run the control loop only, without loading matplotlib')
+    parser.add_argument('--no-blit', action='store_true',
+                        help='redraw the whole figure every frame instead of blitting the lines')
+    parser.add_argument('--bus-daemon', metavar='SOCKET',
+                        help='use the buses through a running bus_daemon.py instead of opening them')
+    parser.add_argument('--shm', nargs='?', const='power_supply_telemetry', metavar='NAME',
+                        help='publish every snapshot and RTD reading to shared memory (telemetry_shm.py)')
+    parser.add_argument('--metrics', type=int, metavar='PORT',
+                        help='serve the latest readings, counters and latencies on http://127.0.0.1:PORT/metrics')
+    args = parser.parse_args(argv)
+    if args.bus_daemon and args.shm:
+        #only the process that owns the buses publishes; here that is the daemon
+        parser.error('--shm has no effect with --bus-daemon: start bus_daemon.py with --shm instead')
     setpoint = 350 #this vlaue is in K, equals 215 C
-    lmp.init_registers()
-    #pid_controllers are the 3 RTD temps that are being used. This should be adjusted to 4 when we decide how to use 4th RTD
-    pid_controllers = [PID(Kp=1.0, Ki=1.0, Kd=1.0, setpoint=setpoint), PID(Kp=1.0, Ki=1.0, Kd=1.0, setpoint=setpoint), PID(Kp=1.0, Ki=1.0, Kd=1.0, setpoint=setpoint)]
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 8))
-    #Create scope for power plot
-    power_scope = Scope(ax1, maxt=20, dt=0.1, modules=3, title="Power of Modules", ylabel="Power (W)", legend_prefix="Module", ylim=(0,100))
-    #Create scope for temperature plot
-    temp_scope = Scope(ax2, maxt=20, dt=0.1, modules=4, title="Temperature of RTDs", ylabel="Temperature (K)", legend_prefix="RTD", ylim=(250,450))
-    #Power and Temperature animations
-    power_ani = animation.FuncAnimation(fig, power_scope.update, emitter_power(pid_controllers, power_supply, modules=3), interval=100, blit=True)
-    temp_ani = animation.FuncAnimation(fig, temp_scope.update, emitter_temp(), interval=100, blit=True)
-    while True:
-        temps = read_temps()
-    #    for i in range(3):
-        current_temp = temps[3]
-        power = pid_controllers[3].update(current_temp)
-        power_supp.set_voltage(4, power)
-        time.sleep(1)
+    shm = None
+    worker = None
+    try:
+        if args.bus_daemon:
+            #the daemon owns SMBus and spidev and has already configured the ADC
+            from bus_daemon import BusClient
+            power_supp = BusClient(args.bus_daemon)
+            temps_source = power_supp.read_tempers
+        else:
+            addr = 0x50
+            power_supp = power_supply(addr)
+            #warm start: skip the ADC reset when it already holds our configuration
+            startup = lmp.init_registers(warm=True)
+            print(f"ADC start up: {startup['mode']}, {startup['seconds']*1000:.1f} ms")
+            temps_source = read_temps
+            if args.shm:
+                #other local readers get the latest values from here instead of the buses
+                from telemetry_shm import TelemetryShm
+                shm = TelemetryShm(args.shm, create=True)
+                power_supp.publishers.append(shm)
+                lmp.publishers.append(shm)
+        #one PID controller per RTD; only the 4th (module 4) is driven for now
+        pid_controllers = [PID(Kp=1.0, Ki=1.0, Kd=1.0, setpoint=setpoint) for _ in range(4)]
+        metrics = None
+        if args.metrics is not None:
+            #scrapes are answered from what the worker last read, never from the buses
+            from metrics_exporter import MetricsCache, serve
+            metrics = MetricsCache()
+            server = serve(metrics, args.metrics)
+            print(f"Metrics on http://127.0.0.1:{server.server_address[1]}/metrics")
+        worker = ControlWorker(power_supp, pid_controllers, pages=(4,), read_temps=temps_source, metrics=metrics)
+        worker.start()
+        if args.headless:
+            try:
+                worker.thread.join()
+            except KeyboardInterrupt:
+                pass
+            return
+        import matplotlib.pyplot as plt
+        import matplotlib.animation as animation
+        from scope_render import Scope
+        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 8))
+        #Create scope for power plot
+        power_scope = Scope(ax1, maxt=20, dt=0.1, modules=1, title="Power of Modules", ylabel="Power (W)", ylim=(0,100), labels=["Module 4"], blit=not args.no_blit)
+        #Create scope for temperature plot
+        temp_scope = Scope(ax2, maxt=20, dt=0.1, modules=4, title="Temperature of RTDs", ylabel="Temperature (K)", legend_prefix="RTD", ylim=(250,450), blit=not args.no_blit)
+        #Power and Temperature animations only drain what the worker published
+        power_ani = animation.FuncAnimation(fig, power_scope.update, emitter(worker.power_samples, 1), interval=100, blit=not args.no_blit, cache_frame_data=False)
+        temp_ani = animation.FuncAnimation(fig, temp_scope.update, emitter(worker.temp_samples, 4), interval=100, blit=not args.no_blit, cache_frame_data=False)
         plt.tight_layout()
         plt.show()
+    finally:
+        if worker is not None:
+            worker.stop()
+        if shm is not None:
+            #ours to remove, or /dev/shm keeps one block per run
+            shm.close()
 
 if __name__ == '__main__':
     main()        
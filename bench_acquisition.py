@@ -0,0 +1,155 @@
+#######################################################################
+# Benchmark the acquisition paths against the simulated buses
+#######################################################################
+
+# Runs the power_supply read/write paths and lmp.read_tempers against
+# simulated_bus devices with a configurable per-transaction delay and reports,
+# per logical sample: bus transactions, bytes moved, p50/p99 latency and the
+# sample rate that latency allows, per module and per RTD. In sequencer mode
+# read_tempers only returns the reader thread's latest values, so there the
+# RTD rate is counted from the results the reader stores instead
+# (rtd_samples_per_s). Results are written as JSON so runs from different
+# commits can be compared:
+#
+#   python bench_acquisition.py --latency 0.0005 --out bench_acquisition.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import larpix_monitor_vac_pressure as lmp
+from simulated_bus import SimulatedAD7124, SimulatedPMBus
+from supper_supp_modules import power_supply
+
+PAGES = [1, 2, 3, 4]
+
+
+def measure(fn, bus, samples, units=1):
+    # time `samples` calls of fn and count what they cost on `bus`; `units` is
+    # how many module or RTD readings one call produces
+    latencies = np.empty(samples)
+    transactions, nbytes = bus.transactions, bus.bytes
+    for i in range(samples):
+        t = time.perf_counter()
+        fn(i)
+        latencies[i] = time.perf_counter() - t
+    transactions = bus.transactions - transactions
+    nbytes = bus.bytes - nbytes
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {
+        'samples': samples,
+        'transactions_per_sample': transactions / samples,
+        'bytes_per_sample': nbytes / samples,
+        'p50_ms': p50 * 1e3,
+        'p99_ms': p99 * 1e3,
+        'samples_per_s': 1 / latencies.mean(),
+        'per_unit_samples_per_s': units / latencies.mean(),
+    }
+
+
+def bench_pmbus(samples, latency):
+    results = {}
+    for transport in ['page', 'page_plus']:
+        for cache_page in [False, True]:
+            bus = SimulatedPMBus(latency=latency)
+            ps = power_supply(0x50, cache_page=cache_page, transport=transport, bus=bus)
+            for page in PAGES:
+                ps.on_mod(page)
+                ps.set_voltage(page, 12.0)
+            name = f'{transport}{"" if cache_page else "_nocache"}'
+            # a logging row the old way, one module per sample
+            results[f'{name}/read_all'] = measure(
+                lambda i: (ps.read_temperature(PAGES[i % 4]), ps.read_voltage(PAGES[i % 4]),
+                           ps.read_current(PAGES[i % 4]), ps.read_power(PAGES[i % 4])),
+                bus, samples)
+            results[f'{name}/read_power'] = measure(lambda i: ps.read_power(PAGES[i % 4]), bus, samples)
+            results[f'{name}/snapshot'] = measure(lambda i: ps.snapshot(PAGES[i % 4]), bus, samples)
+            results[f'{name}/snapshot_all'] = measure(lambda i: ps.snapshot_all(PAGES), bus, samples, len(PAGES))
+            results[f'{name}/set_voltage'] = measure(lambda i: ps.set_voltage(PAGES[i % 4], 12.0), bus, samples)
+    return results
+
+
+def sequencer_rate(adc, seconds):
+    # new RTD results per second the sequencer reader stores, and their bus cost
+    lmp.read_tempers()              # starts the reader, waits for the first results
+    results, transactions = sum(lmp.sequencer_results), adc.transactions
+    t = time.perf_counter()
+    time.sleep(seconds)
+    elapsed = time.perf_counter() - t
+    results = sum(lmp.sequencer_results) - results
+    return {
+        'rtd_samples_per_s': results / elapsed,
+        'transactions_per_rtd_sample': (adc.transactions - transactions) / max(results, 1),
+    }
+
+
+def bench_rtd(samples, latency, spi_speed_hz, seconds):
+    results = {}
+    # the simulated ADC's fingerprint must not replace the real one's
+    state = tempfile.TemporaryDirectory()
+    for sequencer in [False, True]:
+        adc = SimulatedAD7124(latency=latency)
+        lmp.spi = adc
+        lmp.sequencer = sequencer
+        lmp.spi_speed_hz = spi_speed_hz
+        lmp.init_registers(fingerprint_path=os.path.join(state.name, 'ad7124_fingerprint.json'))
+        name = f'read_tempers{"_sequencer" if sequencer else ""}_{lmp.data_rate}'
+        if sequencer:
+            rate = sequencer_rate(adc, seconds)
+            results[name] = measure(lambda i: lmp.read_tempers(), adc, samples, 4)
+            results[name].update(rate)
+            lmp.stop_sequencer_reader()
+        else:
+            results[name] = measure(lambda i: lmp.read_tempers(), adc, samples, 4)
+            results[name]['rtd_samples_per_s'] = results[name]['per_unit_samples_per_s']
+            results[name]['transactions_per_rtd_sample'] = results[name]['transactions_per_sample'] / 4
+    state.cleanup()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the PMBus and RTD acquisition paths')
+    parser.add_argument('--samples', type=int, default=200, help='samples per PMBus case')
+    parser.add_argument('--rtd-samples', type=int, default=20, help='read_tempers cycles')
+    parser.add_argument('--rtd-seconds', type=float, default=2.0,
+                        help='how long to count the sequencer reader\'s results')
+    parser.add_argument('--latency', type=float, default=0.0005, help='seconds per I2C transaction')
+    parser.add_argument('--spi-latency', type=float, default=0.00005, help='seconds per SPI transfer')
+    parser.add_argument('--spi-speed-hz', type=int, default=50000, help='SPI clock to negotiate for')
+    parser.add_argument('--out', help='write JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    # the PMBus setters print every write
+    with contextlib.redirect_stdout(io.StringIO()):
+        pmbus = bench_pmbus(args.samples, args.latency)
+    report = {
+        'commit': git_commit(),
+        'config': vars(args),
+        'pmbus': pmbus,
+        'rtd': bench_rtd(args.rtd_samples, args.spi_latency, args.spi_speed_hz, args.rtd_seconds),
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
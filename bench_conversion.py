@@ -0,0 +1,94 @@
+#######################################################################
+# Benchmark the resistance to temperature conversion
+#######################################################################
+
+# Times interp_resist_to_temp (binary search) against the original linear
+# scan over resistances spread across the whole table and checks that they
+# agree. Then compares the array engines in ct.engines ('table' and the
+# Callendar-Van Dusen 'cvd') for speed and for how far apart they are across
+# -200..850 deg C, overall and per 50 deg C band. Reports as JSON:
+#
+#   python bench_conversion.py --n 100000
+
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+import convert_resistance_to_temperature as ct
+
+
+def time_scalar(fn, resists):
+    t = time.perf_counter()
+    temps = [fn(r) for r in resists]
+    return temps, (time.perf_counter() - t) / len(resists)
+
+
+def time_array(fn, resists, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        temps = fn(resists)
+        best = min(best, time.perf_counter() - t)
+    return temps, best / resists.size
+
+
+def compare_engines(n, rng):
+    lo, hi = ct.resistance_vals[0], ct.resistance_vals[-1]
+    resists = np.asarray(rng.uniform(lo, hi, n))
+    report = {}
+    temps = {}
+    for name in ct.engines:
+        temps[name], per = time_array(lambda r: ct.resist_to_temp(r, name), resists)
+        report[f'{name}_array_ns_per_value'] = per * 1e9
+    _, per = time_scalar(lambda r: float(ct.resist_to_temp(r, 'cvd')), resists[:10000].tolist())
+    report['cvd_scalar_us_per_call'] = per * 1e6
+
+    diff = temps['cvd'] - temps['table']
+    report['cvd_minus_table_max_abs_C'] = float(np.abs(diff).max())
+    report['cvd_minus_table_rms_C'] = float(np.sqrt(np.mean(diff**2)))
+    # where across the range the two disagree most
+    bands = {}
+    edges = np.arange(-200, 851, 50)
+    for t0, t1 in zip(edges[:-1], edges[1:]):
+        sel = (temps['table'] >= t0) & (temps['table'] < t1)
+        if sel.any():
+            bands[f'{t0}..{t1}'] = float(np.abs(diff[sel]).max())
+    report['cvd_minus_table_max_abs_C_by_band'] = bands
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark resistance to temperature conversion')
+    parser.add_argument('--n', type=int, default=100000, help='resistances to convert')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    lo, hi = ct.resistance_vals[0], ct.resistance_vals[-1]
+    # every table entry (the interval edges) plus uniform random points
+    resists = list(ct.resistance_vals) + [rng.uniform(lo, hi) for _ in range(args.n)]
+
+    reference, scan_s = time_scalar(ct.interp_resist_to_temp_scan, resists)
+    temps, bisect_s = time_scalar(ct.interp_resist_to_temp, resists)
+    report = {
+        'n': len(resists),
+        'scan_us_per_call': scan_s * 1e6,
+        'bisect_us_per_call': bisect_s * 1e6,
+        'speedup': scan_s / bisect_s,
+        'max_abs_diff_C': max(abs(a - b) for a, b in zip(temps, reference)),
+        'engines': compare_engines(args.n, np.random.default_rng(args.seed)),
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
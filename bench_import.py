@@ -0,0 +1,93 @@
+#######################################################################
+# Benchmark how long the acquisition and control modules take to import
+#######################################################################
+
+# Imports each module in a fresh interpreter under `python -X importtime` and
+# reports the cumulative import time of the module itself, the peak RSS of
+# that interpreter, and which heavy libraries (numpy, matplotlib, tabulate)
+# the import pulled in. Each module is imported --repeat times and the best
+# run is kept. Results are written as JSON:
+#
+#   python bench_import.py --repeat 5 --out bench_import.json
+
+import argparse
+import json
+import subprocess
+import sys
+
+from bench_acquisition import git_commit
+
+MODULES = [
+    'convert_resistance_to_temperature',
+    'larpix_monitor_vac_pressure',
+    'supper_supp_modules',
+    'bus_worker',
+    'init_temperature_registers',
+    'PID_test',
+    'monitor_and_plot_power',
+]
+
+HEAVY = ['numpy', 'matplotlib', 'tabulate']
+
+# run in the child after the import: what got loaded and how big it is
+# (VmHWM, since ru_maxrss keeps the parent's high-water mark across exec)
+PROBE = '''
+import json, resource, sys
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+try:
+    with open('/proc/self/status') as f:
+        rss = next(int(l.split()[1]) for l in f if l.startswith('VmHWM:'))
+except (OSError, StopIteration):
+    pass
+print(json.dumps({'loaded': [m for m in %r if m in sys.modules], 'maxrss_kb': rss}))
+''' % (HEAVY,)
+
+
+def import_once(module):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}\n{PROBE}'],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {'error': proc.stderr.strip().splitlines()[-1]}
+    # importtime lines: "import time: self [us] | cumulative | imported package"
+    cumulative = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if fields[2].strip() == module:
+            cumulative = int(fields[1])
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['import_ms'] = cumulative / 1e3 if cumulative is not None else None
+    return result
+
+
+def bench(module, repeat):
+    runs = [import_once(module) for _ in range(repeat)]
+    good = [run for run in runs if 'error' not in run]
+    if not good:
+        return runs[0]
+    return min(good, key=lambda run: run['import_ms'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark module import time and footprint')
+    parser.add_argument('modules', nargs='*', default=MODULES, help='modules to import')
+    parser.add_argument('--repeat', type=int, default=3, help='imports per module, best is kept')
+    parser.add_argument('--out', help='write JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = {
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'imports': {module: bench(module, args.repeat) for module in args.modules},
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#######################################################################
+# Benchmark the Scope frame update
+#######################################################################
+
+# Feeds synthetic samples through the Scope data path and reports the cost
+# per frame early and late in the run. 'append' is the old np.append plus
+# boolean-mask update, and 'ring' is scope_buffer.ScopeBuffer. For each it
+# reports the mean time per frame and the bytes allocated per frame
+# (tracemalloc). It then times complete power_plt.Scope frames on the Agg
+# backend. Without blitting a frame is update() plus a full canvas.draw().
+# With blitting it goes through the same steps FuncAnimation(...,
+# blit=True) takes: restore the background, update, draw the lines, blit.
+# The scope window is filled (maxt / dt samples) before the frames are
+# timed, and the blitted frames are timed with and without the per-pixel
+# min/max decimation. Results are written as JSON:
+#
+#   python bench_scope.py --frames 20000 --maxt 20 --dt 0.1
+#   python bench_scope.py --maxt 14400 --dt 0.1         # a 4 hour window
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from bench_acquisition import git_commit
+from scope_buffer import ScopeBuffer
+
+
+class AppendBuffer:
+    # the data path Scope.update used before the ring buffer
+
+    def __init__(self, maxt, channels):
+        self.maxt = maxt
+        self.tdata = np.array([])
+        self.ydatas = [np.array([]) for _ in range(channels)]
+
+    def update(self, t, values):
+        self.tdata = np.append(self.tdata, t)
+        time_filter = self.tdata > (t - self.maxt)
+        self.tdata = self.tdata[time_filter]
+        for i, value in enumerate(values):
+            self.ydatas[i] = np.append(self.ydatas[i], value)
+            self.ydatas[i] = self.ydatas[i][time_filter]
+        return self.tdata, self.ydatas
+
+
+class NoDecimation:
+
+    def update(self, tdata, ydata, span, pixels):
+        return tdata, ydata
+
+
+class RingPath:
+
+    def __init__(self, maxt, dt, channels):
+        self.maxt = maxt
+        self.buffer = ScopeBuffer.for_window(maxt, dt, channels)
+
+    def update(self, t, values):
+        self.buffer.append(t, values)
+        return self.buffer.window(t - self.maxt)
+
+
+def frame_stats(path, frames, dt, channels, sample=200):
+    # mean time and allocated bytes per frame over the first and the last
+    # `sample` frames
+    values = np.random.default_rng(0).uniform(0, 100, (frames, channels))
+    stats = {}
+    for i in range(frames):
+        measure = i < sample or i >= frames - sample
+        if i == 0 or i == frames - sample:
+            tracemalloc.start()
+            elapsed = 0.0
+        if measure:
+            t = time.perf_counter()
+        path.update(i * dt, values[i])
+        if measure:
+            elapsed += time.perf_counter() - t
+        if i == sample - 1 or i == frames - 1:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stats['first' if i < frames - sample else 'last'] = {
+                'us_per_frame': elapsed / sample * 1e6,
+                'peak_bytes': peak,
+            }
+    return stats
+
+
+def scope_frames(frames, maxt, dt, blit, decimate=True):
+    import power_plt
+    fig, ax = plt.subplots()
+    scope = power_plt.Scope(ax, maxt=maxt, dt=dt, modules=4, blit=blit, stats_every=float('inf'))
+    if not decimate:
+        scope.decimator = NoDecimation()
+    fill = int(maxt / dt)
+    rng = np.random.default_rng(1)
+    scope.buffer.extend(np.arange(fill) * dt, rng.uniform(0, 100, (fill, 4)))
+    canvas = fig.canvas
+    for line in scope.lines:
+        line.set_animated(blit)
+    canvas.draw()
+    background = canvas.copy_from_bbox(ax.bbox)
+    redraws = scope.axes.redraws
+    values = np.random.default_rng(0).uniform(0, 100, (frames, 4))
+    times = np.empty(frames)
+    for i in range(frames):
+        t = time.perf_counter()
+        if blit:
+            canvas.restore_region(background)
+        scope.update(((fill + i) * dt, values[i]))
+        if blit:
+            if scope.axes.redraws != redraws:
+                redraws = scope.axes.redraws
+                background = canvas.copy_from_bbox(ax.bbox)
+            for line in scope.lines:
+                ax.draw_artist(line)
+            canvas.blit(ax.bbox)
+        else:
+            canvas.draw()   # FuncAnimation without blit draws the figure after update
+        times[i] = time.perf_counter() - t
+    plt.close(fig)
+    p50, p99 = np.percentile(times, [50, 99])
+    return {'frames': frames, 'p50_ms': p50 * 1e3, 'p99_ms': p99 * 1e3, 'fps': 1 / times.mean(),
+            'full_redraws': scope.axes.redraws}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Scope frame update')
+    parser.add_argument('--frames', type=int, default=20000, help='frames through the data path')
+    parser.add_argument('--draw-frames', type=int, default=300, help='full Scope.update frames')
+    parser.add_argument('--maxt', type=float, default=20.0)
+    parser.add_argument('--dt', type=float, default=0.1)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--out', help='write JSON here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = {
+        'commit': git_commit(),
+        'config': vars(args),
+        'append': frame_stats(AppendBuffer(args.maxt, args.channels), args.frames, args.dt, args.channels),
+        'ring': frame_stats(RingPath(args.maxt, args.dt, args.channels), args.frames, args.dt, args.channels),
+        'scope_frame': scope_frames(args.draw_frames, args.maxt, args.dt, blit=False),
+        'scope_frame_blit': scope_frames(args.draw_frames, args.maxt, args.dt, blit=True),
+        'scope_frame_blit_raw': scope_frames(args.draw_frames, args.maxt, args.dt, blit=True, decimate=False),
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#######################################################################
+# One long-lived process that owns the PMBus supply and the AD7124
+#######################################################################
+
+# Tools talk to the daemon over a Unix domain socket instead of opening
+# SMBus(1) and spidev (0,0) themselves, so two of them can never interleave
+# a PAGE select or an ADC channel selection. The protocol is JSON lines,
+# one request and one response per line:
+#
+#   {"id": 7, "op": "snapshot", "page": 4}
+#   {"id": 7, "ok": true, "result": {"page": 4, "t": ..., "power": ...}}
+#
+# ops: ping, stats, snapshot (page), snapshot_all (pages), read_tempers,
+# on (page), off (page), set_voltage (page, voltage), set_current_limit
+# (page, current_limit), batch (requests: a list of the above)
+#
+# Each bus has a BusWorker thread, and every bus access runs as a job on
+# it. Identical reads that arrive while one is queued or running share that
+# job's result, so N clients polling the same snapshot cost one bus
+# transaction. A write that arrives while the newest queued write to the
+# same page sets the same thing (on and off both set OPERATION) replaces
+# that write's value, and only the newest value is sent to the device.
+# A write is never merged past a different write queued to the same page,
+# a batch's writes included, so the device sees every page's settings
+# change in the order they were requested. A batch runs as one job per bus, so its requests reach the
+# device back to back.
+#
+#   python bus_daemon.py --socket /tmp/power-supply.sock [--simulate] [--shm]
+#
+# and in a tool, BusClient stands in for power_supply and read_tempers:
+#
+#   client = BusClient('/tmp/power-supply.sock')
+#   client.set_voltage(4, 12.0); client.snapshot(4).power; client.read_tempers()
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+
+import bus_worker
+from bus_worker import BusWorker
+from supper_supp_modules import ModuleSnapshot
+
+DEFAULT_SOCKET = '/tmp/power-supply.sock'
+
+READS = {'snapshot', 'snapshot_all', 'read_tempers'}
+WRITES = {'on': 'on_mod', 'off': 'off_mod', 'set_voltage': 'set_voltage',
+          'set_current_limit': 'set_current_limit'}
+# the device setting each write changes; writes to the same one can merge
+SETTINGS = {'on': 'operation', 'off': 'operation', 'set_voltage': 'vout_command',
+            'set_current_limit': 'current_limit'}
+
+
+class BusDaemonError(OSError):
+    pass
+
+
+class BusDaemon:
+
+    def __init__(self, power_supp, adc=None):
+        # adc: anything with read_tempers(), normally larpix_monitor_vac_pressure
+        self.pmbus = BusWorker(power_supp, name='pmbus-worker')
+        self.spi = BusWorker(adc, name='spi-worker') if adc is not None else None
+        self.lock = threading.Lock()
+        self.inflight = {}          # read key -> Future shared by every caller
+        self.pending = {}           # page -> [setting, (op, args), Future] of the newest
+                                    # write queued to it, until that write's job starts
+        self.counts = {'requests': 0, 'bus_jobs': 0, 'coalesced_reads': 0, 'merged_writes': 0}
+
+    def _count(self, name, n=1):
+        with self.lock:
+            self.counts[name] += n
+
+    # reads
+    def read(self, op, *args):
+        key = (op,) + tuple(tuple(a) if isinstance(a, list) else a for a in args)
+        with self.lock:
+            future = self.inflight.get(key)
+            if future is not None and not future.done():
+                self.counts['coalesced_reads'] += 1
+                return future
+            if op == 'read_tempers':
+                if self.spi is None:
+                    raise BusDaemonError('no ADC attached to this daemon')
+                future = self.spi.call('read_tempers')
+            elif op == 'snapshot_all':
+                future = self.pmbus.call('snapshot_all', list(args[0]))
+            else:
+                future = self.pmbus.call(op, *args)
+            self.counts['bus_jobs'] += 1
+            self.inflight[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _done(self, key, future):
+        with self.lock:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+
+    # writes
+    def write(self, op, page, *args):
+        setting = SETTINGS[op]
+        with self.lock:
+            entry = self.pending.get(page)
+            if entry is not None and entry[0] == setting:
+                # nothing else is queued for this page after it: the last
+                # requested value wins, e.g. on, off, on leaves it on
+                entry[1] = (op, args)
+                self.counts['merged_writes'] += 1
+                return entry[2]
+            entry = [setting, (op, args), None]
+            entry[2] = self.pmbus.submit(bus_worker.CONTROL, self._apply, page, entry)
+            self.pending[page] = entry
+            self.counts['bus_jobs'] += 1
+        return entry[2]
+
+    def _apply(self, page, entry):
+        # runs on the bus worker: take the newest value and send it
+        with self.lock:
+            if self.pending.get(page) is entry:
+                del self.pending[page]
+            op, args = entry[1]
+        return getattr(self.pmbus.device, WRITES[op])(page, *args)
+
+    def batch(self, requests):
+        # every PMBus request as one job, then every RTD read as one job
+        pm = [r for r in requests if r.get('op') != 'read_tempers']
+        rtd = [r for r in requests if r.get('op') == 'read_tempers']
+        results = {}
+
+        def run(device, reqs):
+            for r in reqs:
+                try:
+                    results[id(r)] = {'ok': True, 'result': encode(direct(device, r))}
+                except Exception as e:
+                    results[id(r)] = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+        futures = []
+        if pm:
+            with self.lock:
+                # the batch is now the newest write to each page it writes
+                # to: a later write must not merge into one queued before it
+                for r in pm:
+                    if r.get('op') in WRITES:
+                        self.pending.pop(r.get('page'), None)
+                futures.append(self.pmbus.submit(bus_worker.CONTROL, run, self.pmbus.device, pm))
+        if rtd:
+            if self.spi is None:
+                raise BusDaemonError('no ADC attached to this daemon')
+            futures.append(self.spi.submit(bus_worker.CONTROL, run, self.spi.device, rtd))
+        self._count('bus_jobs', len(futures))
+        for future in futures:
+            future.result()
+        return [results[id(r)] for r in requests]
+
+    def handle(self, request):
+        self._count('requests')
+        op = request.get('op')
+        if op == 'ping':
+            return 'pong'
+        if op == 'stats':
+            with self.lock:
+                return dict(self.counts)
+        if op == 'batch':
+            return self.batch(request['requests'])
+        if op == 'snapshot':
+            return encode(self.read(op, request['page']).result())
+        if op == 'snapshot_all':
+            return encode(self.read(op, request['pages']).result())
+        if op == 'read_tempers':
+            return encode(self.read(op).result())
+        if op == 'set_voltage':
+            return self.write(op, request['page'], request['voltage']).result()
+        if op == 'set_current_limit':
+            return self.write(op, request['page'], request['current_limit']).result()
+        if op in ('on', 'off'):
+            return self.write(op, request['page']).result()
+        raise BusDaemonError(f'unknown op {op!r}')
+
+    def stop(self):
+        self.pmbus.stop()
+        if self.spi is not None:
+            self.spi.stop()
+
+
+def direct(device, r):
+    # one batched request, run on the worker thread that owns device
+    op = r['op']
+    if op == 'read_tempers':
+        return device.read_tempers()
+    if op == 'snapshot':
+        return device.snapshot(r['page'])
+    if op == 'snapshot_all':
+        return device.snapshot_all(r['pages'])
+    if op == 'set_voltage':
+        return device.set_voltage(r['page'], r['voltage'])
+    if op == 'set_current_limit':
+        return device.set_current_limit(r['page'], r['current_limit'])
+    if op in ('on', 'off'):
+        return getattr(device, WRITES[op])(r['page'])
+    raise BusDaemonError(f'unknown op {op!r}')
+
+
+def encode(result):
+    if isinstance(result, ModuleSnapshot):
+        return result._asdict()
+    if isinstance(result, list):
+        return [encode(r) for r in result]
+    return result
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        daemon = self.server.bus_daemon
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            request = None
+            try:
+                request = json.loads(line)
+                response = {'id': request.get('id'), 'ok': True, 'result': daemon.handle(request)}
+            except Exception as e:
+                response = {'id': request.get('id') if isinstance(request, dict) else None,
+                            'ok': False, 'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+class BusServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, daemon):
+        if os.path.exists(path):
+            # a socket left behind by a daemon that is gone; refuse to take
+            # over one that still answers
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                os.remove(path)
+            else:
+                probe.close()
+                raise BusDaemonError(f'a bus daemon is already listening on {path}')
+        self.bus_daemon = daemon
+        super().__init__(path, _Handler)
+
+
+class BusClient:
+
+    # the power_supply / read_tempers calls the tools use, sent to the daemon
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+        self.lock = threading.Lock()
+        self._id = 0
+
+    def request(self, op, **fields):
+        with self.lock:
+            self._id += 1
+            self.file.write((json.dumps({'id': self._id, 'op': op, **fields}) + '\n').encode())
+            self.file.flush()
+            line = self.file.readline()
+        if not line:
+            raise BusDaemonError('bus daemon closed the connection')
+        response = json.loads(line)
+        if not response['ok']:
+            raise BusDaemonError(response['error'])
+        return response['result']
+
+    def snapshot(self, page):
+        return ModuleSnapshot(**self.request('snapshot', page=page))
+
+    def snapshot_all(self, pages):
+        return [ModuleSnapshot(**s) for s in self.request('snapshot_all', pages=list(pages))]
+
+    def read_tempers(self):
+        return self.request('read_tempers')
+
+    def on_mod(self, page):
+        return self.request('on', page=page)
+
+    def off_mod(self, page):
+        return self.request('off', page=page)
+
+    def set_voltage(self, page, voltage):
+        return self.request('set_voltage', page=page, voltage=voltage)
+
+    def set_current_limit(self, page, current_limit):
+        return self.request('set_current_limit', page=page, current_limit=current_limit)
+
+    def batch(self, requests):
+        # a list of request dicts; returns one {'ok', 'result'/'error'} per request
+        return self.request('batch', requests=requests)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Own the PMBus supply and the AD7124 and serve them on a Unix socket')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--simulate', action='store_true', help='serve the simulated buses')
+    parser.add_argument('--no-adc', action='store_true', help='serve the supply only')
+    parser.add_argument('--shm', nargs='?', const='power_supply_telemetry', metavar='NAME',
+                        help='also publish every snapshot and RTD reading to shared memory (telemetry_shm.py)')
+    args = parser.parse_args(argv)
+
+    from supper_supp_modules import power_supply
+    bus = None
+    if args.simulate:
+        from simulated_bus import SimulatedPMBus
+        bus = SimulatedPMBus(latency=0.001)
+    power_supp = power_supply(0x50, bus=bus)
+    adc = None
+    if not args.no_adc:
+        import larpix_monitor_vac_pressure as lmp
+        fingerprint_path = None
+        if args.simulate:
+            from simulated_bus import SimulatedAD7124
+            lmp.spi = SimulatedAD7124()
+            # keep the simulated ADC's fingerprint away from the real one's
+            state = tempfile.TemporaryDirectory()
+            fingerprint_path = os.path.join(state.name, 'ad7124_fingerprint.json')
+        startup = lmp.init_registers(warm=True, fingerprint_path=fingerprint_path)
+        print(f"ADC start up: {startup['mode']}, {startup['seconds']*1000:.1f} ms")
+        adc = lmp
+    shm = None
+    if args.shm:
+        from telemetry_shm import TelemetryShm
+        shm = TelemetryShm(args.shm, create=True)
+        power_supp.publishers.append(shm)
+        if adc is not None:
+            adc.publishers.append(shm)
+    daemon = BusDaemon(power_supp, adc)
+    server = BusServer(args.socket, daemon)
+    print(f'bus daemon listening on {args.socket}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+        daemon.stop()
+        power_supp.close()
+        if shm is not None:
+            shm.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#######################################################################
+# One thread that owns a bus device (e.g. supper_supp_modules.power_supply)
+#######################################################################
+
+# Every call on the device runs as a single job on this thread, so a page
+# select and the command that follows it can never be split by another
+# caller. Jobs sit in a priority queue: control writes (on/off, VOUT_COMMAND,
+# current limit) are served before queued telemetry polls, and jobs of equal
+# priority run in submission order. Callers get a concurrent.futures.Future
+# back, so the logger can queue a whole row of reads without blocking the
+# operator and collect the results afterwards.
+
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+CONTROL = 0         # priorities, lower runs first
+TELEMETRY = 1
+_STOP = 2           # sorts after everything already queued
+
+
+class BusWorker:
+
+    def __init__(self, device, name='bus-worker'):
+        self.device = device
+        self.jobs = queue.PriorityQueue()
+        self._seq = itertools.count()      # keeps FIFO order within a priority
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, priority, fn, *args, **kwargs):
+        future = Future()
+        self.jobs.put((priority, next(self._seq), fn, args, kwargs, future))
+        return future
+
+    def call(self, method, *args, priority=TELEMETRY, **kwargs):
+        # run any device method by name, e.g. call('read_status', 2)
+        return self.submit(priority, getattr(self.device, method), *args, **kwargs)
+
+    # control writes
+    def on_mod(self, page):
+        return self.submit(CONTROL, self.device.on_mod, page)
+
+    def off_mod(self, page):
+        return self.submit(CONTROL, self.device.off_mod, page)
+
+    def set_voltage(self, page, voltage):
+        return self.submit(CONTROL, self.device.set_voltage, page, voltage)
+
+    def set_current_limit(self, page, current_limit):
+        return self.submit(CONTROL, self.device.set_current_limit, page, current_limit)
+
+    # telemetry polls
+    def snapshot(self, page):
+        return self.submit(TELEMETRY, self.device.snapshot, page)
+
+    def snapshot_all(self, pages):
+        # one future per page, so results can be collected as they complete
+        return [self.snapshot(page) for page in pages]
+
+    def stop(self, timeout=None):
+        # let the queued jobs finish, then end the thread
+        self.jobs.put((_STOP, next(self._seq), None, (), {}, None))
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            priority, seq, fn, args, kwargs, future = self.jobs.get()
+            if fn is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
@@ -2,7 +2,75 @@
 # Convert a resistance reading to a temperature
 #######################################################################
 
+import bisect
+
 def interp_resist_to_temp(resist):
+    if resist < resistance_vals[0] or resist > resistance_vals[-1]: 
+        raise ValueError(f"Value of {resist} out of range(19,390)")
+    # binary search for the table interval holding resist: i is the last
+    # entry below resist (or 0), the same interval the linear scan picks
+    i = max(bisect.bisect_left(resistance_vals, resist) - 1, 0)
+    delta_r = resistance_vals[i+1] - resistance_vals[i]
+    cur_dr = resist - resistance_vals[i]
+    temp = temperature_vals[i] + cur_dr/delta_r
+    return temp
+
+# vectorized form of interp_resist_to_temp for arrays of any shape; values
+# outside the table come back as NaN instead of raising. A scalar gives a float
+def resist_to_temp_array(resist):
+    import numpy as np
+    resist = np.asarray(resist, dtype=np.float64)
+    temp = np.interp(resist, resistance_vals, temperature_vals)
+    temp = np.where((resist < resistance_vals[0]) | (resist > resistance_vals[-1]), np.nan, temp)
+    return float(temp) if temp.ndim == 0 else temp
+
+# Callendar-Van Dusen (IEC 60751) Pt100: R0 = 100 Ohm and
+#   R(T) = R0 (1 + A T + B T^2)                    for T >= 0 deg C
+#   R(T) = R0 (1 + A T + B T^2 + C (T - 100) T^3)  for T <  0 deg C
+cvd_r0 = 100.0
+cvd_a = 3.9083e-3
+cvd_b = -5.775e-7
+cvd_c = -4.183e-12
+# least-squares 5th order fit of T(R) to the equation above over -200..0 deg C
+# (highest power first, max error 6e-5 deg C)
+cvd_low_poly = [1.524540444e-10, -2.818829843e-08, -4.825909802e-06,
+                2.585903175e-03, 2.222811374, -242.0199115]
+
+# closed-form Callendar-Van Dusen inverse, no table. Above 0 deg C (R >= R0)
+# it is the root of the quadratic, below it the polynomial fit. Works on
+# scalars and arrays of any shape; outside -200..850 deg C gives NaN like
+# resist_to_temp_array
+def cvd_resist_to_temp(resist):
+    if isinstance(resist, (int, float)):
+        # plain floats skip numpy, which costs more than the arithmetic here
+        if resist < resistance_vals[0] or resist > resistance_vals[-1]:
+            return float('nan')
+        if resist >= cvd_r0:
+            return (-cvd_a + (cvd_a**2 - 4*cvd_b*(1 - resist/cvd_r0))**0.5) / (2*cvd_b)
+        temp = 0.0
+        for coef in cvd_low_poly:
+            temp = temp*resist + coef
+        return temp
+    import numpy as np
+    resist = np.asarray(resist, dtype=np.float64)
+    high = (-cvd_a + np.sqrt(np.maximum(cvd_a**2 - 4*cvd_b*(1 - resist/cvd_r0), 0))) / (2*cvd_b)
+    low = np.polyval(cvd_low_poly, resist)
+    temp = np.where(resist >= cvd_r0, high, low)
+    temp = np.where((resist < resistance_vals[0]) | (resist > resistance_vals[-1]), np.nan, temp)
+    return float(temp) if temp.ndim == 0 else temp
+
+# conversion engines with one interface: resistance (scalar or array) in,
+# deg C out (a float for a scalar), NaN where out of range
+engines = {
+    'table': resist_to_temp_array,
+    'cvd': cvd_resist_to_temp,
+}
+
+def resist_to_temp(resist, engine='table'):
+    return engines[engine](resist)
+
+# the original linear scan, kept as the reference for bench_conversion.py
+def interp_resist_to_temp_scan(resist):
     if resist < resistance_vals[0] or resist > resistance_vals[-1]: 
         raise ValueError(f"Value of {resist} out of range(19,390)")
     i = 0
@@ -1,206 +1,638 @@
-
-import numpy as np
-# An SPI (Serial Peripheral Interface bus) transports information to or 
-# from the AD7124-8 (temperature sensors)
-import spidev
-spi = spidev.SpiDev()           # abbreviate spidev
-import time
-import convert_resistance_to_temperature as ct
-# tabulate formats tabled output which we'll use to check register settings
-from tabulate import tabulate
-
-
-######################################################################
-# Initialize global variables
-######################################################################    
-
-#global file_name
-
-test = True
-table = []                  # table of register settings
-read= 1                     # messages sent to the communications register
-write = 0
-data_rate = 'low'          # choices are 'high', 'medium' or 'low'
-                            # (samples per second) read from the ADC
-
-# list of AD7124-8 register names, number of bits, reset values, and note
-registers = [
-    ["Status",8, 0x00, ''],
-    ["ADC Control", 16, 0x0000, ''],
-    ["Data", 24, 0x000000, ''],
-    ["IO Control 1", 24, 0x000000, ''],
-    ["IO Control 2", 16, 0x0000, ''],
-    ["ID", 8, 0x17, ''],
-    ["Error", 24, 0x000000, ''],
-    ["ERROR_EN", 24, 0x000040, ''],
-    ["MCLK_COUNT", 8, 0x00, ''],
-    ["CHANNEL_0", 16, 0x8001, ''],
-    ["CHANNEL_1", 16, 0x0001, ''],
-    ["CHANNEL_2", 16, 0x0001, ''],
-    ["CHANNEL_3", 16, 0x0001, ''],
-    ["CHANNEL_4", 16, 0x0001, ''],
-    ["CHANNEL_5", 16, 0x0001, ''],
-    ["CHANNEL_6", 16, 0x0001, ''],
-    ["CHANNEL_7", 16, 0x0001, ''],
-    ["CHANNEL_8", 16, 0x0001, ''],
-    ["CHANNEL_9", 16, 0x0001, ''],
-    ["CHANNEL_10", 16, 0x0001, ''],
-    ["CHANNEL_11", 16, 0x0001, ''],
-    ["CHANNEL_12", 16, 0x0001, ''],
-    ["CHANNEL_13", 16, 0x0001, ''],
-    ["CHANNEL_14", 16, 0x0001, ''],
-    ["CHANNEL_15", 16, 0x0001, ''],
-    ["CONFIG_0", 16, 0x0860, ''],
-    ["CONFIG_1", 16, 0x0860, ''],
-    ["CONFIG_2", 16, 0x0860, ''],
-    ["CONFIG_3", 16, 0x0860, ''],
-    ["CONFIG_4", 16, 0x0860, ''],
-    ["CONFIG_5", 16, 0x0860, ''],
-    ["CONFIG_6", 16, 0x0860, ''],
-    ["CONFIG_7", 16, 0x0860, ''],
-    ["FILTER_0", 24, 0x060180, ''],
-    ["FILTER_1", 24, 0x060180, ''],
-    ["FILTER_2", 24, 0x060180, ''],
-    ["FILTER_3", 24, 0x060180, ''],
-    ["FILTER_4", 24, 0x060180, ''],
-    ["FILTER_5", 24, 0x060180, ''],
-    ["FILTER_6", 24, 0x060180, ''],
-    ["FILTER_7", 24, 0x060180, ''],
-    ["OFFSET_0", 24, 0x800000, ''],
-    ["OFFSET_1", 24, 0x800000, ''],
-    ["OFFSET_2", 24, 0x800000, ''],
-    ["OFFSET_3", 24, 0x800000, ''],
-    ["OFFSET_4", 24, 0x800000, ''],
-    ["OFFSET_5", 24, 0x800000, ''],
-    ["OFFSET_6", 24, 0x800000, ''],
-    ["OFFSET_7", 24, 0x800000, ''],
-    ["GAIN_0", 24, 0x000001, ''],
-    ["GAIN_1", 24, 0x000001, ''],
-    ["GAIN_2", 24, 0x000001, ''],
-    ["GAIN_3", 24, 0x000001, ''],
-    ["GAIN_4", 24, 0x000001, ''],
-    ["GAIN_5", 24, 0x000001, ''],
-    ["GAIN_6", 24, 0x000001, ''],
-    ["GAIN_7", 24, 0x000001, '']]
-
-
-# set up the spi (i.e. the mechanism to communicate with the device)
-def set_up_spi():
-
-    bus = 0                         # only SPI bus 0 is available
-    device = 0                      # chip select pin (either 0 or 1)
-    spi.open(bus, device)           # open the specified connection
-    spi.max_speed_hz = 50000       # set SPI speed
-    spi.mode = 3 # Mode 3 samples on falling edge, shifts out on rising edge
-
-# set the AD7124-8 regsiters for our purposes
-def init_registers():
-    # set up the ability to read and write to the registers. Reset all registers
-    set_up_spi()
-
-    # reset all adc registers to their default values
-    msg = [0xFF,0xFF,0xFF,0xFF,0xFF,0xFF,0xFF,0xFF]
-    spi.xfer2(msg)
-
-    # set the data rate in the filter_0 register
-    address = 0x21                     # register 33 is filter_0
-    if data_rate == 'high':            # sets the data rate for setup0
-        msg = [address+write*64, 0, 0, 1] 
-        registers[address][3] = '- high data rate = 19k Samples/second -'
-    elif data_rate == 'medium':
-        msg = [address+write*64, 0, 0, 0b0111_1000]
-        registers[address][3] = '- medium data rate = 160 Samples/sec --'
-    elif data_rate == 'low':
-        msg = [address+write*64, 0, 0, 0b1111_1111]
-        registers[address][3] = '- low data rate = 9.4k Samples/sec -'
-    else:
-        registers[address][3] = f'data_rate setting ({data_rate}) was not a valid choice'
-    spi.xfer2(msg)
-
-    # enable Channel 0: Ain1 (positive) Ain0 (negative): Cryo Top 
-    address = 0x9                         # address 9 is channel 0
-    msg = [address + write*64, 0b1000_0000, 0b0010_0000]
-    spi.xfer2(msg)
-    registers[address][3] = '- enabled w setup0, pos=Ain1, neg=Ain0 -'
-
-    # set current out to Ain7 using an excitation current of 50 micro-A
-    address = 3                     # register 3 is IO_Control_1
-    msg = [address + write*64, 0, 0b0000_0001, 0b0000_0111]
-    spi.xfer2(msg)
-    registers[address][3] = f'- Ain7 output, ex current = 50 microA -'
-
-    # set  bipolar OFF, enable buffers for Ain(+/-) and Refin(+/-), 
-    # set Ref source = REFIN1(+/-), gain = 8
-    address = 0x19                    # register 25 is Config_0
-    msg = [address + write*64, 0b0000_0001, 0b1110_0011] 
-    spi.xfer2(msg)
-    registers[address][3] = '- Gain = 8, bipolar OFF, buffers, REFIN1(+/-) -'
-
-    # set the power mode in the ADC_CONTROL register
-    address = 1                     # register 1 is ADC_CONTROL
-    msg = [address+write*64, 0, 0b1100_0000] # Chooses power=full
-    spi.xfer2(msg)
-    registers[address][3] = '------ Power = Full ------'
-
-# get a new temperature reading from the ADC
-def read_tempers():
-
-    # initialize variables
-    write = 0
-    read = 1            # command to read from ADC
-    address_status = 0  # ADC status is available on register 0
-    address_data = 2	# ADC Data is available on register 2
-    address_ch0 = 9
-    decimal_result = 0
-    temperatures = [0,0,0,0]
-
-    # 4 sensor register settings: enable, Ain positive, Ain negative
-    sensor_inputs = [0b1000_0011, # sensor pin 3-4 
-                     0b0110_0010,  # pin 2-3
-                     0b0100_0001,  # pin 1-2
-                     0b0010_0000]  # pin 0-1
-
-    # used to calibrate ADC readings to degree C
-    adc_910 =  11054300               # ADC reading for 920 Ohm
-    adc_429 =  1660520              # ADC reading for 429 Ohm
-
-    for sensor in range(0,4):
-
-        # enable channel 0 to read the desired sensor's inputs
-        msg = [address_ch0 + write*64, 0b1000_0000, sensor_inputs[sensor]]
-        spi.xfer2(msg)
-
-        # read the status register
-        msg = [address_status + read*64, 0]
-        status_result = spi.xfer2(msg)
-
-        # keep reading the status register until there is new data 
-        # (i.e. highest bit=0)
-        while status_result[1] > 0b0111_111:
-            status_result = spi.xfer2(msg)
-            
-        # read the new adc measurement
-        msg = [address_data + read*64, 0, 0, 0]
-        data_result = spi.xfer2(msg)
-        
-        # convert the 24 bit adc reading into a decimal value
-        decimal_result = data_result[1]*(2**16) + data_result[2]*(2**8) + data_result[3]
-        temperatures[sensor]=decimal_result
-        # Determine resistance for the sensor reading
-        resistance = 199.5 + (29.98 - 199.5) * (decimal_result - adc_910) / (adc_429 - adc_910)
-        
-        # Convert resistance to temperature in Celcius (via interpolation
-        # function from convert_resistance_to_termperature.py, and 
-        # convert celcius to kelvin. First check range(19,390) which 
-        # is necessary for the conversion function to work
-        if resistance <= 19 or resistance >= 390:
-            # this eroneous value is intended to alert user to a problem
-            temperatures[sensor] = float(0.00)
-            
-        else:
-            temperatures[sensor] = ct.interp_resist_to_temp(resistance) + 273.15
-
-    return temperatures
-
-
-
+
+# An SPI (Serial Peripheral Interface bus) transports information to or 
+# from the AD7124-8 (temperature sensors)
+try:
+    import spidev
+    spi = spidev.SpiDev()           # abbreviate spidev
+except ImportError:
+    # no SPI on this machine: assign a stand-in such as
+    # simulated_bus.SimulatedAD7124() to spi before use
+    spi = None
+import os
+import threading
+import time
+import hashlib
+import json
+import convert_resistance_to_temperature as ct
+
+
+######################################################################
+# Initialize global variables
+######################################################################    
+
+#global file_name
+
+test = True
+table = []                  # table of register settings
+read= 1                     # messages sent to the communications register
+write = 0
+data_rate = 'low'          # choices are 'high', 'medium' or 'low'
+                            # (samples per second) read from the ADC
+
+spi_speed_hz = 50000        # SPI clock to run at; above safe_spi_speed_hz it is
+                            # only kept if the readback check passes
+safe_spi_speed_hz = 50000   # clock known to work on our wiring
+max_spi_speed_hz = 5000000  # fastest SCLK the AD7124 is rated for
+spi_bad_transfers = 0       # garbled transfers seen since start up
+spi_reference_id = None     # ID register as read at the safe speed
+data_status = True          # append STATUS to every DATA read (ADC_CONTROL bit 10)
+
+sequencer = False           # True: init_registers enables one channel per sensor
+                            # and read_tempers reads the ADC's channel sequencer
+
+# 4 sensor register settings: enable, Ain positive, Ain negative
+sensor_inputs = [0b1000_0011, # sensor pin 3-4 
+                 0b0110_0010,  # pin 2-3
+                 0b0100_0001,  # pin 1-2
+                 0b0010_0000]  # pin 0-1
+
+# filter FS value written to FILTER_0 for each data_rate choice
+filter_fs = {'high': 1, 'medium': 0b0111_1000, 'low': 0b1111_1111}
+
+ready_timeout = 1.0         # seconds to wait for a conversion before giving up
+reset_wait = 0.001          # seconds to leave the ADC after a reset before the
+                            # next access (the datasheet asks for far less)
+
+# histogram of how long each wait for a conversion took: counts[i] holds
+# waits up to ready_wait_edges[i] seconds, the last count everything longer
+ready_wait_edges = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0]
+ready_wait_counts = [0] * (len(ready_wait_edges) + 1)
+
+# raised when the ADC has no new result within ready_timeout, e.g. a wedged
+# ADC or an unplugged sensor
+class AdcTimeoutError(TimeoutError):
+    pass
+
+# where init_registers(warm=True) keeps the fingerprint of the configuration
+# it last programmed, and how the last start up went. The file lives in a
+# fixed state directory ($AD7124_FINGERPRINT overrides it), never the working
+# directory, so a run started elsewhere cannot overwrite the real ADC's.
+# Runs against the simulated ADC pass their own fingerprint_path
+fingerprint_file = os.environ.get('AD7124_FINGERPRINT') or os.path.join(
+    os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state'),
+    'power-supply', 'ad7124_fingerprint.json')
+last_startup = None
+
+# latest sequencer result per sensor: raw ADC code and the time.monotonic()
+# at which its conversion finished (None until the first result arrives),
+# and how many results each sensor has had
+latest_codes = [None, None, None, None]
+latest_times = [None, None, None, None]
+sequencer_results = [0, 0, 0, 0]
+last_poll_time = None       # start of the previous poll_sequencer transfer
+
+# sequencer mode: the thread that keeps draining the ADC into latest_codes
+sequencer_thread = None
+sequencer_stop = threading.Event()
+sequencer_timeouts = 0
+
+# objects with publish_tempers(temperatures), e.g. a telemetry_shm.TelemetryShm,
+# that are handed every read_tempers result
+publishers = []
+
+# used to calibrate ADC readings to degree C
+adc_910 =  11054300               # ADC reading for 920 Ohm
+adc_429 =  1660520              # ADC reading for 429 Ohm
+
+# list of AD7124-8 register names, number of bits, reset values, and note
+registers = [
+    ["Status",8, 0x00, ''],
+    ["ADC Control", 16, 0x0000, ''],
+    ["Data", 24, 0x000000, ''],
+    ["IO Control 1", 24, 0x000000, ''],
+    ["IO Control 2", 16, 0x0000, ''],
+    ["ID", 8, 0x17, ''],
+    ["Error", 24, 0x000000, ''],
+    ["ERROR_EN", 24, 0x000040, ''],
+    ["MCLK_COUNT", 8, 0x00, ''],
+    ["CHANNEL_0", 16, 0x8001, ''],
+    ["CHANNEL_1", 16, 0x0001, ''],
+    ["CHANNEL_2", 16, 0x0001, ''],
+    ["CHANNEL_3", 16, 0x0001, ''],
+    ["CHANNEL_4", 16, 0x0001, ''],
+    ["CHANNEL_5", 16, 0x0001, ''],
+    ["CHANNEL_6", 16, 0x0001, ''],
+    ["CHANNEL_7", 16, 0x0001, ''],
+    ["CHANNEL_8", 16, 0x0001, ''],
+    ["CHANNEL_9", 16, 0x0001, ''],
+    ["CHANNEL_10", 16, 0x0001, ''],
+    ["CHANNEL_11", 16, 0x0001, ''],
+    ["CHANNEL_12", 16, 0x0001, ''],
+    ["CHANNEL_13", 16, 0x0001, ''],
+    ["CHANNEL_14", 16, 0x0001, ''],
+    ["CHANNEL_15", 16, 0x0001, ''],
+    ["CONFIG_0", 16, 0x0860, ''],
+    ["CONFIG_1", 16, 0x0860, ''],
+    ["CONFIG_2", 16, 0x0860, ''],
+    ["CONFIG_3", 16, 0x0860, ''],
+    ["CONFIG_4", 16, 0x0860, ''],
+    ["CONFIG_5", 16, 0x0860, ''],
+    ["CONFIG_6", 16, 0x0860, ''],
+    ["CONFIG_7", 16, 0x0860, ''],
+    ["FILTER_0", 24, 0x060180, ''],
+    ["FILTER_1", 24, 0x060180, ''],
+    ["FILTER_2", 24, 0x060180, ''],
+    ["FILTER_3", 24, 0x060180, ''],
+    ["FILTER_4", 24, 0x060180, ''],
+    ["FILTER_5", 24, 0x060180, ''],
+    ["FILTER_6", 24, 0x060180, ''],
+    ["FILTER_7", 24, 0x060180, ''],
+    ["OFFSET_0", 24, 0x800000, ''],
+    ["OFFSET_1", 24, 0x800000, ''],
+    ["OFFSET_2", 24, 0x800000, ''],
+    ["OFFSET_3", 24, 0x800000, ''],
+    ["OFFSET_4", 24, 0x800000, ''],
+    ["OFFSET_5", 24, 0x800000, ''],
+    ["OFFSET_6", 24, 0x800000, ''],
+    ["OFFSET_7", 24, 0x800000, ''],
+    ["GAIN_0", 24, 0x000001, ''],
+    ["GAIN_1", 24, 0x000001, ''],
+    ["GAIN_2", 24, 0x000001, ''],
+    ["GAIN_3", 24, 0x000001, ''],
+    ["GAIN_4", 24, 0x000001, ''],
+    ["GAIN_5", 24, 0x000001, ''],
+    ["GAIN_6", 24, 0x000001, ''],
+    ["GAIN_7", 24, 0x000001, '']]
+
+
+# set up the spi (i.e. the mechanism to communicate with the device)
+def set_up_spi(speed_hz=None):
+
+    bus = 0                         # only SPI bus 0 is available
+    device = 0                      # chip select pin (either 0 or 1)
+    spi.open(bus, device)           # open the specified connection
+    spi.max_speed_hz = safe_spi_speed_hz  # set SPI speed
+    spi.mode = 3 # Mode 3 samples on falling edge, shifts out on rising edge
+    negotiate_spi_speed(spi_speed_hz if speed_hz is None else speed_hz)
+
+# read several registers in one transfer: the AD7124 takes the next command
+# byte as soon as the previous register has been clocked out. Set
+# data_status when reading DATA (register 2) with DATA_STATUS enabled, so the
+# appended STATUS byte is skipped. dev defaults to this module's spi
+def read_registers(addresses, dev=None, data_status=False):
+    dev = spi if dev is None else dev
+    sizes = []
+    msg = []
+    for address in addresses:
+        nbytes = registers[address][1] // 8
+        if address == 2 and data_status:
+            nbytes += 1
+        sizes.append(nbytes)
+        msg += [address + read*64] + [0]*nbytes
+    result = dev.xfer2(msg)
+    values = []
+    i = 0
+    for address, nbytes in zip(addresses, sizes):
+        if address == 2 and data_status:
+            value = int.from_bytes(bytes(result[i+1:i+nbytes]), 'big')
+        else:
+            value = int.from_bytes(bytes(result[i+1:i+1+nbytes]), 'big')
+        values.append(value)
+        i += 1 + nbytes
+    return values
+
+# read the ID register several times in one transfer and check every copy
+# matches the reference read at the safe speed
+def spi_readback_ok(reference, reads=8):
+    return read_registers([5]*reads) == [reference]*reads
+
+# run the SPI clock as close to speed_hz as the readback check allows,
+# halving it until the check passes and never going below the safe speed
+def negotiate_spi_speed(speed_hz):
+    global spi_reference_id
+    spi.max_speed_hz = safe_spi_speed_hz
+    if speed_hz <= safe_spi_speed_hz:
+        return spi.max_speed_hz
+    spi_reference_id = read_registers([5])[0]
+    speed = min(speed_hz, max_spi_speed_hz)
+    while speed > safe_spi_speed_hz:
+        spi.max_speed_hz = speed
+        if spi_readback_ok(spi_reference_id):
+            return speed
+        speed //= 2
+    spi.max_speed_hz = safe_spi_speed_hz
+    return spi.max_speed_hz
+
+# called when a transfer came back garbled (e.g. a status for a channel that
+# is not enabled): count it and drop to a lower clock that passes the
+# readback check
+def spi_bad_transfer():
+    global spi_bad_transfers
+    spi_bad_transfers += 1
+    if spi.max_speed_hz > safe_spi_speed_hz:
+        negotiate_spi_speed(spi.max_speed_hz // 2)
+
+# when running above the safe speed, re-check the ID readback (one short
+# transfer) and fall back to a slower clock if it no longer matches
+def check_spi_link():
+    if spi.max_speed_hz > safe_spi_speed_hz and not spi_readback_ok(spi_reference_id, reads=2):
+        spi_bad_transfer()
+
+# read DATA with STATUS appended in one 5 byte transfer (DATA_STATUS mode)
+def read_data_status():
+    address_data = 2
+    result = spi.xfer2([address_data + read*64, 0, 0, 0, 0])
+    return result[1]*(2**16) + result[2]*(2**8) + result[3], result[4]
+
+# shadow copy of the ADC registers: address -> value last written to (or
+# read back from) the device. Addresses missing from it are unknown
+shadow = {}
+
+# read the given registers back in one transfer and make the shadow copy
+# agree with the device, so apply_config only writes what it does not hold
+def read_shadow(addresses):
+    addresses = list(addresses)
+    for address, value in zip(addresses, read_registers(addresses)):
+        shadow[address] = value
+
+# write one register and keep the shadow copy in step
+def write_register(address, value):
+    nbytes = registers[address][1] // 8
+    msg = [address + write*64] + list(value.to_bytes(nbytes, 'big'))
+    spi.xfer2(msg)
+    shadow[address] = value
+
+# reset all adc registers to their default values; the shadow copy then
+# holds the reset values from the registers table
+def reset_adc():
+    msg = [0xFF,0xFF,0xFF,0xFF,0xFF,0xFF,0xFF,0xFF]
+    spi.xfer2(msg)
+    time.sleep(reset_wait)
+    shadow.clear()
+    for address in range(0, len(registers)):
+        shadow[address] = registers[address][2]
+
+# the register settings we want, as {address: (value, note)} in the order
+# they should be written (ADC_CONTROL last, as it starts the conversions)
+def desired_registers():
+    desired = {}
+
+    # set the data rate in the filter_0 register (register 33)
+    if data_rate == 'high':            # sets the data rate for setup0
+        desired[0x21] = (0x000001, '- high data rate = 19k Samples/second -')
+    elif data_rate == 'medium':
+        desired[0x21] = (0b0111_1000, '- medium data rate = 160 Samples/sec --')
+    elif data_rate == 'low':
+        desired[0x21] = (0b1111_1111, '- low data rate = 9.4k Samples/sec -')
+    else:
+        registers[0x21][3] = f'data_rate setting ({data_rate}) was not a valid choice'
+
+    if sequencer:
+        # one channel per sensor, all on setup0, for the ADC's sequencer
+        for sensor in range(0,4):
+            desired[0x9 + sensor] = (0b1000_0000 << 8 | sensor_inputs[sensor],
+                                     f'- enabled w setup0, sensor {sensor} -')
+    else:
+        # enable Channel 0: Ain1 (positive) Ain0 (negative): Cryo Top
+        desired[0x9] = (0b1000_0000_0010_0000, '- enabled w setup0, pos=Ain1, neg=Ain0 -')
+
+    # set current out to Ain7 using an excitation current of 50 micro-A
+    desired[3] = (0b0000_0001_0000_0111, '- Ain7 output, ex current = 50 microA -')
+
+    # set  bipolar OFF, enable buffers for Ain(+/-) and Refin(+/-),
+    # set Ref source = REFIN1(+/-), gain = 8
+    desired[0x19] = (0b0000_0001_1110_0011, '- Gain = 8, bipolar OFF, buffers, REFIN1(+/-) -')
+
+    # set the power mode in the ADC_CONTROL register
+    if data_status:
+        desired[1] = (0b0000_0100_1100_0000, '--- Power = Full, DATA_STATUS ---')
+    else:
+        desired[1] = (0b0000_0000_1100_0000, '------ Power = Full ------')
+    return desired
+
+# write the registers whose shadow value differs from the desired one and
+# return the addresses written
+def apply_config(desired=None):
+    if desired is None:
+        desired = desired_registers()
+    written = []
+    for address, (value, note) in desired.items():
+        registers[address][3] = note
+        if shadow.get(address) != value:
+            write_register(address, value)
+            written.append(address)
+    return written
+
+# read back the given registers in one transfer (plus the ERROR register)
+# and return a list of (address, expected, actual) for every mismatch; a
+# non-zero ERROR register is reported as address 6 with expected 0
+def verify_registers(addresses, desired=None):
+    if desired is None:
+        desired = desired_registers()
+    addresses = list(addresses)
+    values = read_registers(addresses + [6])
+    failures = []
+    for address, value in zip(addresses, values):
+        shadow[address] = value
+        if value != desired[address][0]:
+            failures.append((address, desired[address][0], value))
+    if values[-1] != 0:
+        failures.append((6, 0, values[-1]))
+    return failures
+
+# a short hash of the desired register values, persisted after programming
+def config_fingerprint(desired):
+    text = ','.join(f'{address}={value[0]}' for address, value in sorted(desired.items()))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+# the registers (and masked values) a warm start checks: the desired
+# settings, except that in single channel mode CHANNEL_0 is reprogrammed by
+# every read_tempers call, so there only CHANNEL_1..3 being disabled counts
+def warm_start_checks(desired):
+    checks = {}
+    for address, (value, note) in desired.items():
+        checks[address] = (0xFFFFFF, value)
+    if not sequencer:
+        checks[0x9] = (0x8000, 0x8000)
+        for address in range(0xA, 0xD):
+            checks[address] = (0x8000, 0)
+    return checks
+
+# True when the ADC already runs exactly the configuration we would program:
+# the persisted fingerprint matches the desired one and was written for this
+# chip's ID, ERROR is clear, and the key registers read back as desired
+def config_matches(desired, path=None):
+    saved = load_fingerprint(path)
+    if saved is None:
+        return False
+    if saved.get('fingerprint') != config_fingerprint(desired):
+        return False
+    checks = warm_start_checks(desired)
+    addresses = sorted(checks)
+    values = read_registers([5, 6] + addresses)
+    if values[0] != saved.get('id') or values[1] != 0:
+        return False
+    for address, value in zip(addresses, values[2:]):
+        mask, expected = checks[address]
+        if value & mask != expected:
+            return False
+        shadow[address] = value
+    return True
+
+def load_fingerprint(path=None):
+    try:
+        with open(path or fingerprint_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_fingerprint(desired, path=None):
+    saved = {'fingerprint': config_fingerprint(desired), 'id': read_registers([5])[0]}
+    path = path or fingerprint_file
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(saved, f)
+    except OSError as e:
+        # the ADC is configured either way; the next start up will be cold
+        print(f"Could not save the ADC fingerprint to {path}: {e}")
+
+# set the AD7124-8 regsiters for our purposes. With warm=True the reset and
+# reprogramming are skipped when the ADC already holds the configuration
+# (see config_matches), which keeps its filter history and gives readings
+# right away. fingerprint_path overrides fingerprint_file. Returns (and
+# keeps in last_startup) the mode used and how long start up took
+def init_registers(warm=False, fingerprint_path=None):
+    global last_startup
+    start = time.monotonic()
+    # set up the ability to read and write to the registers
+    # the reader must not talk to the ADC while it is reprogrammed
+    stop_sequencer_reader()
+    set_up_spi()
+    desired = desired_registers()
+    if warm and config_matches(desired, fingerprint_path):
+        mode = 'warm'
+    else:
+        # reset all registers and program them
+        mode = 'cold'
+        reset_adc()
+        apply_config(desired)
+        save_fingerprint(desired, fingerprint_path)
+
+    if sequencer:
+        for sensor in range(0,4):
+            latest_codes[sensor] = None
+            latest_times[sensor] = None
+    last_startup = {'mode': mode, 'seconds': time.monotonic() - start}
+    return last_startup
+
+# time for one settled conversion after a channel change: the sinc4 filter
+# at full power runs at 19200/FS samples per second and needs 4 of them
+def conversion_time():
+    return 4 * filter_fs.get(data_rate, 1) / 19200
+
+# wait for poll() to report a new result without spinning: sleep through
+# most of the expected conversion time, then poll with a doubling backoff
+# until the deadline, after which AdcTimeoutError is raised. Every wait is
+# added to the ready_wait histogram
+def wait_for_ready(poll, expected=None, timeout=None):
+    if expected is None:
+        expected = conversion_time()
+    if timeout is None:
+        timeout = ready_timeout
+    start = time.monotonic()
+    deadline = start + max(timeout, expected)
+    time.sleep(expected * 0.9)
+    delay = max(expected / 50, 0.0001)
+    while not poll():
+        now = time.monotonic()
+        if now >= deadline:
+            record_ready_wait(now - start)
+            raise AdcTimeoutError(f"AD7124 had no new conversion after {now - start:.3f} s")
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, max(expected / 4, 0.001))
+    record_ready_wait(time.monotonic() - start)
+
+def record_ready_wait(seconds):
+    for i, edge in enumerate(ready_wait_edges):
+        if seconds <= edge:
+            ready_wait_counts[i] += 1
+            return
+    ready_wait_counts[-1] += 1
+
+def ready_wait_stats():
+    return {'edges_s': list(ready_wait_edges), 'counts': list(ready_wait_counts),
+            'total': sum(ready_wait_counts)}
+
+# read DATA with the appended STATUS in one transfer. If the status says the
+# result is new, store it in the latest-value buffer under its channel and
+# return the channel, otherwise return None. DATA always holds the newest
+# result, so a new one finished after the previous poll started; it is
+# stamped halfway between the two polls rather than with the time it was read
+def poll_sequencer():
+    global last_poll_time
+    previous = last_poll_time
+    now = last_poll_time = time.monotonic()
+    code, status = read_data_status()
+    if status & 0b1000_0000:        # RDY is low active: no new result yet
+        return None
+    channel = status & 0b0000_1111
+    if channel >= 4:                # no such channel enabled: garbled transfer
+        spi_bad_transfer()
+        return None
+    latest_codes[channel] = code
+    latest_times[channel] = now if previous is None else (previous + now) / 2
+    sequencer_results[channel] += 1
+    return channel
+
+# body of the sequencer reader thread: take every result as the ADC
+# produces it, so none is overwritten unread
+def sequencer_reader():
+    global sequencer_timeouts
+    while not sequencer_stop.is_set():
+        try:
+            check_spi_link()
+            for sensor in range(0,4):
+                # start polling just before the next result is due, so the
+                # poll before it is close and its time stamp tight
+                stamps = [t for t in latest_times if t is not None]
+                expected = conversion_time()
+                if stamps:
+                    expected = max(max(stamps) + expected - time.monotonic(), 0)
+                wait_for_ready(lambda: poll_sequencer() is not None, expected)
+        except AdcTimeoutError as e:
+            sequencer_timeouts += 1
+            print(f"Sequencer reader: {e}")
+
+def start_sequencer_reader():
+    global sequencer_thread, last_poll_time
+    if sequencer_thread is not None and sequencer_thread.is_alive():
+        return
+    sequencer_stop.clear()
+    last_poll_time = None
+    sequencer_thread = threading.Thread(target=sequencer_reader, name='ad7124-sequencer', daemon=True)
+    sequencer_thread.start()
+
+def stop_sequencer_reader():
+    global sequencer_thread
+    if sequencer_thread is not None:
+        sequencer_stop.set()
+        sequencer_thread.join()
+        sequencer_thread = None
+
+# convert the latest sequencer codes to Kelvin, 0.0 for out of range (or not
+# yet read) sensors as in read_tempers
+def latest_tempers():
+    temperatures = [0,0,0,0]
+    for sensor in range(0,4):
+        if latest_codes[sensor] is None:
+            temperatures[sensor] = float(0.00)
+            continue
+        resistance = code_to_resistance(latest_codes[sensor])
+        if resistance <= 19 or resistance >= 390:
+            temperatures[sensor] = float(0.00)
+        else:
+            temperatures[sensor] = ct.interp_resist_to_temp(resistance) + 273.15
+    return temperatures
+
+# sequencer version of read_tempers: the newest result of every sensor from
+# the reader thread (started on first use), without touching the SPI bus.
+# Only the first call waits, until every sensor has had a result. Each
+# sensor still gets a new value once per sequencer cycle, i.e. every
+# 4 * conversion_time(): a channel switch needs the full filter settling
+# whether the sequencer or read_tempers makes it. What this mode saves is
+# the reconfiguration writes, the blocking in the caller and the results a
+# caller that is not waiting would miss; latest_times says how old each is
+def read_tempers_sequenced():
+    start_sequencer_reader()
+    deadline = time.monotonic() + 4 * conversion_time() + ready_timeout
+    while any(t is None for t in latest_times):
+        if time.monotonic() >= deadline:
+            raise AdcTimeoutError("AD7124 sequencer produced no result for some sensors")
+        time.sleep(conversion_time() / 4)
+    return latest_tempers()
+
+# hand a read_tempers result to the publishers and return it
+def publish_tempers(temperatures):
+    for publisher in publishers:
+        publisher.publish_tempers(temperatures)
+    return temperatures
+
+# get a new temperature reading from the ADC
+def read_tempers():
+    if sequencer:
+        return publish_tempers(read_tempers_sequenced())
+    check_spi_link()
+
+    # initialize variables
+    write = 0
+    read = 1            # command to read from ADC
+    address_status = 0  # ADC status is available on register 0
+    address_data = 2	# ADC Data is available on register 2
+    address_ch0 = 9
+    decimal_result = 0
+    temperatures = [0,0,0,0]
+
+    for sensor in range(0,4):
+
+        # enable channel 0 to read the desired sensor's inputs
+        write_register(address_ch0, 0b1000_0000 << 8 | sensor_inputs[sensor])
+
+        if data_status:
+            # read DATA with STATUS appended until the status shows new
+            # data (i.e. highest bit=0) from channel 0, sleeping between
+            # reads and giving up with AdcTimeoutError after ready_timeout
+            reading = []
+            def poll():
+                code, status = read_data_status()
+                if status > 0b0111_111:
+                    return False
+                if status & 0b0000_1111 != 0:   # only channel 0 is enabled
+                    spi_bad_transfer()
+                    return False
+                reading.append(code)
+                return True
+            wait_for_ready(poll)
+            decimal_result = reading[0]
+        else:
+            # read the status register until there is new data
+            # (i.e. highest bit=0), sleeping between reads and giving up
+            # with AdcTimeoutError after ready_timeout seconds
+            msg = [address_status + read*64, 0]
+            wait_for_ready(lambda: spi.xfer2(msg)[1] <= 0b0111_111)
+
+            # read the new adc measurement
+            msg = [address_data + read*64, 0, 0, 0]
+            data_result = spi.xfer2(msg)
+
+            # convert the 24 bit adc reading into a decimal value
+            decimal_result = data_result[1]*(2**16) + data_result[2]*(2**8) + data_result[3]
+        temperatures[sensor]=decimal_result
+        # Determine resistance for the sensor reading
+        resistance = code_to_resistance(decimal_result)
+        
+        # Convert resistance to temperature in Celcius (via interpolation
+        # function from convert_resistance_to_termperature.py, and 
+        # convert celcius to kelvin. First check range(19,390) which 
+        # is necessary for the conversion function to work
+        if resistance <= 19 or resistance >= 390:
+            # this eroneous value is intended to alert user to a problem
+            temperatures[sensor] = float(0.00)
+            
+        else:
+            temperatures[sensor] = ct.interp_resist_to_temp(resistance) + 273.15
+
+    return publish_tempers(temperatures)
+
+# two-point calibration of a raw 24 bit ADC code (or an array of them) to
+# the RTD resistance in Ohm
+def code_to_resistance(code):
+    return 199.5 + (29.98 - 199.5) * (code - adc_910) / (adc_429 - adc_910)
+
+# convert raw ADC codes of any shape to Kelvin in one vectorized pass, e.g.
+# to reprocess logged raw data or an ADC burst. Readings outside the
+# range(19,390) Ohm that read_tempers reports as 0.0 come back as NaN;
+# with return_mask=True a boolean array marking the valid readings is
+# returned as well. engine picks the conversion in ct.engines ('table' or
+# 'cvd')
+def codes_to_kelvin(codes, return_mask=False, engine='table'):
+    import numpy as np          # only needed here, keeps the module import light
+    resistance = code_to_resistance(np.asarray(codes, dtype=np.float64))
+    valid = (resistance > 19) & (resistance < 390)
+    kelvin = np.where(valid, ct.resist_to_temp(resistance, engine) + 273.15, np.nan)
+    if return_mask:
+        return kelvin, valid
+    return kelvin
+
+
+
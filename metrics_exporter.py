@@ -0,0 +1,265 @@
+#######################################################################
+# OpenMetrics endpoint for the supply modules and the RTDs
+#######################################################################
+
+# A scrape is answered from MetricsCache, which holds the newest module
+# snapshots and RTD temperatures together with acquisition counters and
+# latency histograms. Only the acquisition loop fills the cache, so a
+# scrape never touches the hardware however often it comes.
+#
+# MetricsCache has the publisher hooks (publish_snapshot, publish_tempers),
+# so it can also be appended to power_supply.publishers or
+# larpix_monitor_vac_pressure.publishers. Its timed() context manager
+# records how long a bus read took, and whether it failed.
+#
+# On its own, this script runs the acquisition loop and serves /metrics.
+# It reads the buses itself, goes through a running bus_daemon.py, or uses
+# the simulated buses:
+#
+#   python metrics_exporter.py --simulate --port 9108
+#   curl -s localhost:9108/metrics
+
+import argparse
+import bisect
+import contextlib
+import math
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+MODULE_GAUGES = [
+    # (metric, ModuleSnapshot field, help)
+    ('power_supply_module_voltage_volts', 'voltage', 'Output voltage (READ_VOUT)'),
+    ('power_supply_module_current_amperes', 'current', 'Output current (READ_IOUT)'),
+    ('power_supply_module_power_watts', 'power', 'Output power, voltage times current'),
+    ('power_supply_module_temperature_celsius', 'temp', 'Module temperature (READ_TEMPERATURE_1)'),
+    ('power_supply_module_status_word', 'status', 'STATUS_WORD'),
+]
+
+
+def format_value(value):
+    # OpenMetrics spells the non-finite values NaN, +Inf and -Inf
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)      # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.modules = {}           # page -> newest ModuleSnapshot
+        self.tempers = None         # (monotonic t, [K per RTD])
+        self.snapshots = {}         # page -> snapshots published
+        self.rtd_reads = 0
+        self.errors = {}            # op -> failed reads
+        self.latency = {}           # op -> Histogram
+        self.scrapes = 0
+
+    # publisher hooks, called by the acquisition side
+    def publish_snapshot(self, snap):
+        with self.lock:
+            self.modules[snap.page] = snap
+            self.snapshots[snap.page] = self.snapshots.get(snap.page, 0) + 1
+
+    def publish_tempers(self, temperatures):
+        with self.lock:
+            self.tempers = (time.monotonic(), list(temperatures))
+            self.rtd_reads += 1
+
+    def observe(self, op, seconds):
+        with self.lock:
+            if op not in self.latency:
+                self.latency[op] = Histogram()
+            self.latency[op].observe(seconds)
+
+    def error(self, op):
+        with self.lock:
+            self.errors[op] = self.errors.get(op, 0) + 1
+
+    @contextlib.contextmanager
+    def timed(self, op):
+        # with cache.timed('snapshot_all'): snaps = power_supp.snapshot_all(pages)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.error(op)
+            raise
+        finally:
+            self.observe(op, time.perf_counter() - start)
+
+    def render(self):
+        # the cache as OpenMetrics text
+        with self.lock:
+            self.scrapes += 1
+            now = time.monotonic()
+            out = []
+            for metric, field, text in MODULE_GAUGES:
+                out += [f'# TYPE {metric} gauge', f'# HELP {metric} {text}']
+                for page, snap in sorted(self.modules.items()):
+                    out.append(f'{metric}{{page="{page}"}} {format_value(getattr(snap, field))}')
+            metric = 'power_supply_module_sample_age_seconds'
+            out += [f'# TYPE {metric} gauge', f'# HELP {metric} Seconds since the newest snapshot was taken']
+            for page, snap in sorted(self.modules.items()):
+                out.append(f'{metric}{{page="{page}"}} {now - snap.t:.3f}')
+            metric = 'power_supply_snapshots'
+            out += [f'# TYPE {metric} counter', f'# HELP {metric} Module snapshots acquired']
+            for page, n in sorted(self.snapshots.items()):
+                out.append(f'{metric}_total{{page="{page}"}} {n}')
+
+            t, temps = self.tempers if self.tempers is not None else (None, [])
+            out += ['# TYPE rtd_temperature_kelvin gauge', '# HELP rtd_temperature_kelvin RTD temperature, 0 when out of range']
+            for i, kelvin in enumerate(temps):
+                out.append(f'rtd_temperature_kelvin{{rtd="{i + 1}"}} {format_value(kelvin)}')
+            out += ['# TYPE rtd_sample_age_seconds gauge', '# HELP rtd_sample_age_seconds Seconds since the newest RTD reading']
+            if t is not None:
+                out.append(f'rtd_sample_age_seconds {now - t:.3f}')
+            out += ['# TYPE rtd_reads counter', '# HELP rtd_reads RTD readings acquired',
+                    f'rtd_reads_total {self.rtd_reads}']
+
+            metric = 'acquisition_errors'
+            out += [f'# TYPE {metric} counter', f'# HELP {metric} Bus reads that raised']
+            for op, n in sorted(self.errors.items()):
+                out.append(f'{metric}_total{{op="{op}"}} {n}')
+            metric = 'acquisition_latency_seconds'
+            out += [f'# TYPE {metric} histogram', f'# HELP {metric} Time taken by each bus read']
+            for op, hist in sorted(self.latency.items()):
+                cumulative = 0
+                for le, n in zip(list(hist.buckets) + ['+Inf'], hist.counts):
+                    cumulative += n
+                    out.append(f'{metric}_bucket{{op="{op}",le="{le}"}} {cumulative}')
+                out.append(f'{metric}_count{{op="{op}"}} {hist.count}')
+                out.append(f'{metric}_sum{{op="{op}"}} {format_value(hist.sum)}')
+            out += ['# TYPE metrics_scrapes counter', '# HELP metrics_scrapes Scrapes served',
+                    f'metrics_scrapes_total {self.scrapes}', '# EOF']
+        return '\n'.join(out) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.cache.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass        # a scrape every few seconds would flood the console
+
+
+def serve(cache, port=9108, host='127.0.0.1'):
+    # serve /metrics from cache on a daemon thread; returns the server
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.cache = cache
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
+
+
+def acquire(cache, power_supp, pages, read_tempers=None, interval=1.0, stop_event=None):
+    # the acquisition loop: everything the endpoint shows is read here
+    stop_event = stop_event or threading.Event()
+    next_cycle = time.monotonic()
+    while not stop_event.is_set():
+        try:
+            with cache.timed('snapshot_all'):
+                snaps = power_supp.snapshot_all(pages)
+            for snap in snaps:
+                cache.publish_snapshot(snap)
+        except OSError as e:
+            print(f'snapshot_all failed: {e}')
+        if read_tempers is not None:
+            try:
+                with cache.timed('read_tempers'):
+                    temps = read_tempers()
+                cache.publish_tempers(temps)
+            except OSError as e:
+                print(f'read_tempers failed: {e}')
+        next_cycle += interval
+        stop_event.wait(max(next_cycle - time.monotonic(), 0))
+        if next_cycle < time.monotonic():
+            next_cycle = time.monotonic()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve module and RTD telemetry as OpenMetrics')
+    parser.add_argument('--port', type=int, default=9108)
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 2, 3, 4])
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between acquisition cycles')
+    parser.add_argument('--simulate', action='store_true', help='read the simulated buses')
+    parser.add_argument('--bus-daemon', metavar='SOCKET', help='read through a running bus_daemon.py')
+    parser.add_argument('--no-adc', action='store_true', help='modules only, no RTDs')
+    args = parser.parse_args(argv)
+
+    if args.bus_daemon:
+        from bus_daemon import BusClient
+        power_supp = BusClient(args.bus_daemon)
+        read_tempers = None if args.no_adc else power_supp.read_tempers
+    else:
+        from supper_supp_modules import power_supply
+        bus = None
+        if args.simulate:
+            from simulated_bus import SimulatedPMBus
+            bus = SimulatedPMBus(latency=0.001)
+        power_supp = power_supply(0x50, bus=bus)
+        if args.simulate:
+            # something to look at: every simulated module on at 12 V
+            for page in args.pages:
+                power_supp.on_mod(page)
+                power_supp.set_voltage(page, 12.0)
+        read_tempers = None
+        if not args.no_adc:
+            import larpix_monitor_vac_pressure as lmp
+            fingerprint_path = None
+            if args.simulate:
+                from simulated_bus import SimulatedAD7124
+                lmp.spi = SimulatedAD7124()
+                # keep the simulated ADC's fingerprint away from the real one's
+                state = tempfile.TemporaryDirectory()
+                fingerprint_path = os.path.join(state.name, 'ad7124_fingerprint.json')
+            lmp.init_registers(warm=True, fingerprint_path=fingerprint_path)
+            read_tempers = lmp.read_tempers
+
+    cache = MetricsCache()
+    server = serve(cache, args.port, args.host)
+    print(f'serving http://{args.host}:{server.server_address[1]}/metrics')
+    try:
+        acquire(cache, power_supp, args.pages, read_tempers, args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        power_supp.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,8 @@
-from smbus import SMBus   # pmbus command library
 import sys
 import time
 import csv
 from datetime import datetime
 import threading
-import numpy as np
 
 
 def read_power(self, page):
@@ -24,6 +22,7 @@ def read_temps():
 class power_supply:
 
 	def __init__(self, addr, id=1):
+		from smbus import SMBus   # pmbus command library
 		self.bus = SMBus(id)
 		self.address = addr	
 
@@ -63,7 +62,7 @@ class PID:
         self.last_output=None
         self.last_input=None
         
-	def update(self, current_value):
+    def update(self, current_value):
 
         '''if not self.auto_mode:
             return self._last_output
@@ -83,15 +82,15 @@ class PID:
         proportional = self.Kp * error
         #integral term
         self.integral += error
-		integral = self.Ki * self.integral
-		#derivative term
-		derivative = self.Kd * (error - self.last_error)
-		#PID control output
+        integral = self.Ki * self.integral
+        #derivative term
+        derivative = self.Kd * (error - self.last_error)
+        #PID control output
         output = proportional + integral + derivative
         output = max(self.output_limits[0], min(output, self.output_limits[1]))
         #getting error for next calculation
         self.last_error = error		
-		return output
+        return output
 
 
 def main():
@@ -107,7 +106,8 @@ def main():
 			power_supp.set_voltage(i + 1, power)
 		time.sleep(1)
 
-main()
+if __name__ == '__main__':
+	main()
 
 
 
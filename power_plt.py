@@ -1,67 +1,112 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-from matplotlib.lines import Line2D
+import sys
 import time
 import csv
+import os
+from datetime import datetime
+import scope_render
+import telemetry_query as tq
 
-class Scope():
-    def __init__(self, ax, maxt=10, dt=0.1, modules=4):
-        self.ax = ax
-        self.dt = dt
-        self.maxt = maxt
-        self.modules = modules
-        self.tdata = np.array([])
-        self.ydatas = [np.array([]) for _ in range(modules)]  
-        self.t0 = time.perf_counter()
-        
-        self.colors = ['r', 'g', 'm', 'b']
-        self.lines = [Line2D([], [], color=self.colors[i], label=f'Module {i+1}') for i in range(modules)]
-        #self.lines = [Line2D([], []) for _ in range(modules)]  
-        for line in self.lines:
-            self.ax.add_line(line)
-        self.ax.set_ylim(0, 160)  
-        self.ax.set_xlim(0, self.maxt)
-        self.ax.set_title("Power of Modules")
-        self.ax.set_xlabel("Time (s)")
-        self.ax.set_ylabel("Power (W)")
-        self.ax.legend(loc='upper left')
+#Follows a growing CSV log (e.g. module_log.csv from mod_log). read_rows()
+#returns every complete row appended since the last call; a partial last
+#line is kept until its newline arrives. When the file is replaced
+#(rotated) or truncated it is reopened from the top. With live_window
+#(seconds) the first file is entered at its last live_window seconds
+#instead of replaying the whole backlog.
+class CsvTail():
+    def __init__(self, filename, live_window=None, time_format=tq.CSV_TIME_FORMAT):
+        self.filename = filename
+        self.live_window = live_window
+        self.time_format = time_format
+        self.file = None
+        self.partial = b''
 
-    def update(self, data):
-        t, powers = data
-        self.tdata = np.append(self.tdata, t)
-        time_filter = self.tdata > (t - self.maxt)
-        self.tdata = self.tdata[time_filter]
-        
-        for i, power in enumerate(powers):
-            self.ydatas[i] = np.append(self.ydatas[i], power)
-            self.ydatas[i] = self.ydatas[i][time_filter]
-            
-        for i, line in enumerate(self.lines):
-            line.set_data(self.tdata, self.ydatas[i])
-        self.ax.set_xlim(self.tdata[0], self.tdata[0] + self.maxt)
-        self.ax.figure.canvas.draw()
-        return self.lines
+    def _open(self):
+        try:
+            self.file = open(self.filename, 'rb')
+        except FileNotFoundError:
+            return False
+        self.partial = b''
+        self.file.readline()                    #header
+        if not self.file.tell():
+            self.file.close()                   #not even a header yet
+            self.file = None
+            return False
+        if self.live_window is not None:
+            data_start = self.file.tell()
+            last = tq.csv_last_time(self.file, data_start, self.time_format)
+            if last is None:
+                self.file.seek(data_start)
+            else:
+                self.file.seek(tq.csv_offset(self.file, last - int(self.live_window * 1e9), data_start, self.time_format))
+            self.live_window = None             #only skip ahead in the first file
+        return True
 
-    def emitter(self, filename):
-        with open(filename, 'r') as csvfile:
-            csvreader = csv.reader(csvfile)
-            next(csvreader)  
-            start_time = time.perf_counter()
+    def _rotated(self):
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            return False                        #keep draining the old file until a new one appears
+        return st.st_ino != os.fstat(self.file.fileno()).st_ino or st.st_size < self.file.tell()
 
-            while True:
-                t = time.perf_counter() - start_time
+    def read_rows(self):
+        if self.file is None and not self._open():
+            return []
+        data = self.partial + self.file.read()
+        if self._rotated():
+            #finish the old file, then continue with the new one from its top
+            data += self.file.read()
+            self.file.close()
+            self.file = None
+            lines = data.split(b'\n')
+            rows = [next(csv.reader([line.decode()])) for line in lines[:-1] if line.strip()]
+            return rows + self.read_rows()
+        lines = data.split(b'\n')
+        self.partial = lines[-1]
+        return [next(csv.reader([line.decode()])) for line in lines[:-1] if line.strip()]
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+#the power log scope: scope_render.Scope with Module labels, fed from the
+#CSV log that mod_log writes
+class Scope(scope_render.Scope):
+    def __init__(self, ax, maxt=10, dt=0.1, modules=4, blit=True, stats_every=10.0):
+        super().__init__(ax, maxt=maxt, dt=dt, modules=modules, title="Power of Modules", ylabel="Power (W)",
+                         ylim=(0, 160), blit=blit, stats_every=stats_every)
+        self.t_ref = None                     #epoch seconds shown as t = 0
+
+    #yields, once per frame, every row logged since the previous frame as one
+    #batch (ts, powers), with t taken from the rows' own timestamps. With
+    #skip_to_live the plot starts at the last maxt seconds of the log
+    def emitter(self, filename, skip_to_live=False):
+        tail = CsvTail(filename, live_window=self.maxt if skip_to_live else None)
+        columns = [4 + i*4 for i in range(self.modules)]      #Module i Power
+        while True:
+            ts = []
+            powers = []
+            for row in tail.read_rows():
                 try:
-                    row = next(csvreader) 
-                    powers = [float(row[4 + i*4]) for i in range(self.modules)]  
-                    yield t, powers
-                except StopIteration:
-                    time.sleep(0.1)  
-                    continue
+                    t = datetime.strptime(row[0], tail.time_format).timestamp()
+                    values = [float(row[c]) for c in columns]
+                except (ValueError, IndexError):
+                    continue                    #a repeated header or a damaged row
+                ts.append(t)
+                powers.append(values)
+            if ts and self.t_ref is None:
+                self.t_ref = ts[0]
+            ts = np.array(ts) - (self.t_ref or 0)
+            yield ts, np.array(powers).reshape(len(ts), self.modules)
 
 if __name__ == '__main__':
     fig, ax = plt.subplots()
-    scope = Scope(ax, maxt=20, dt=0.1, modules=4)
+    blit = '--no-blit' not in sys.argv       #redraw the whole figure every frame instead
+    scope = Scope(ax, maxt=20, dt=0.1, modules=4, blit=blit)
     filename = 'module_log.csv'  
-    ani = animation.FuncAnimation(fig, scope.update, scope.emitter(filename), interval=100, blit=True)
+    skip_to_live = '--live' in sys.argv     #start at the last 20 s instead of replaying the log
+    ani = animation.FuncAnimation(fig, scope.update, scope.emitter(filename, skip_to_live), interval=100, blit=blit)
     plt.show()
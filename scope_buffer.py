@@ -0,0 +1,70 @@
+#######################################################################
+# Fixed-size sample history for the Scope plots
+#######################################################################
+
+# A circular buffer of timestamps and one row of values per channel. Every
+# sample is written twice, at i and at i + capacity, so the newest
+# `count` samples are always one contiguous slice. window() can then hand
+# plain views to Line2D.set_data: nothing is allocated or copied per frame,
+# and memory stays at 2 * capacity samples however long the GUI runs.
+#
+# Scope sizes the buffer from maxt / dt. If samples arrive faster than dt,
+# the window shows the newest `capacity` samples instead of the full maxt.
+
+import math
+
+import numpy as np
+
+
+class ScopeBuffer:
+
+    def __init__(self, capacity, channels):
+        self.capacity = capacity
+        self.channels = channels
+        self.t = np.zeros(2 * capacity)
+        self.y = np.zeros((channels, 2 * capacity))
+        self.head = 0           # where the next sample goes, 0 <= head < capacity
+        self.count = 0
+
+    @classmethod
+    def for_window(cls, maxt, dt, channels, margin=2):
+        # room for maxt seconds at one sample per dt, with headroom for jitter
+        return cls(int(math.ceil(margin * maxt / dt)) + 1, channels)
+
+    def append(self, t, values):
+        i = self.head
+        self.t[i] = self.t[i + self.capacity] = t
+        n = min(len(values), self.channels)
+        self.y[:n, i] = self.y[:n, i + self.capacity] = values[:n]
+        self.head = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def extend(self, ts, values):
+        # a batch of samples: ts has shape (n,), values (n, channels)
+        ts = np.asarray(ts, dtype=float)
+        if len(ts) == 0:
+            return
+        values = np.asarray(values, dtype=float).reshape(len(ts), -1)
+        if len(ts) > self.capacity:
+            ts, values = ts[-self.capacity:], values[-self.capacity:]
+        n = len(ts)
+        k = min(values.shape[1], self.channels)
+        idx = (self.head + np.arange(n)) % self.capacity
+        for offset in (0, self.capacity):
+            self.t[idx + offset] = ts
+            self.y[:k, idx + offset] = values[:, :k].T
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+    def window(self, tmin=None):
+        # (t, y) views of the stored samples, oldest first, optionally only
+        # those with t > tmin; y has one row per channel
+        end = self.head + self.capacity
+        start = end - self.count
+        if tmin is not None:
+            start += int(np.searchsorted(self.t[start:end], tmin, 'right'))
+        return self.t[start:end], self.y[:, start:end]
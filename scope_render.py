@@ -0,0 +1,236 @@
+#######################################################################
+# Axis limits and frame statistics for blitted Scope animations
+#######################################################################
+
+# With FuncAnimation(..., blit=True) a frame only restores the cached axes
+# background and redraws the returned lines. That breaks as soon as a
+# frame changes the axis limits, because the whole figure, including the
+# tick labels, has to be redrawn. ScrollingAxes therefore keeps the limits
+# fixed for as long as it can:
+# - the time axis is step seconds wider than maxt and jumps forward by
+#   whole steps when the newest sample reaches its right edge;
+# - the y axis only changes when visible data leaves the current band.
+# Only then does it call canvas.draw() once. FuncAnimation sees the new
+# view and re-captures its background from that draw.
+#
+# MinMaxDecimator turns the visible window into one min/max pair per pixel
+# column. The line draws a vertical stroke per column, so a one-sample
+# spike still shows at any zoom. Buckets are aligned to absolute time. Each
+# frame folds only the samples that are new since the last frame into the
+# cached buckets, drops the buckets that scrolled off the left edge and
+# recomputes the one the left edge cuts through from its visible samples.
+# The cache is rebuilt only when the bucket width changes (the axis span or
+# the widget width).
+#
+# FrameStats measures the time between frames (achieved FPS) and the time
+# spent in Scope.update, and prints a summary every `every` seconds.
+#
+# Scope puts these together behind a ScopeBuffer: one line per channel on
+# an axes, fed by FuncAnimation with (t, values) or a batch (ts, values).
+# The scopes in power_plt.py and PID_test.py only add their labels and
+# emitters.
+
+import time
+
+import numpy as np
+
+from scope_buffer import ScopeBuffer
+
+
+class ScrollingAxes:
+
+    def __init__(self, ax, maxt, step=None, ymargin=0.1):
+        self.ax = ax
+        self.maxt = maxt
+        self.step = step if step is not None else maxt / 4
+        self.span = self.maxt + self.step       # width of the time axis
+        self.ymargin = ymargin
+        self.redraws = 0
+
+    def update(self, tdata, ydata):
+        # returns True when the limits moved and the figure was redrawn
+        if not len(tdata):
+            return False
+        changed = False
+        x0, x1 = self.ax.get_xlim()
+        t = tdata[-1]
+        if t > x1 or t < x0:
+            x0 = t - self.maxt
+            self.ax.set_xlim(x0, x0 + self.span)
+            changed = True
+        y = np.asarray(ydata)
+        y = y[np.isfinite(y)]
+        if y.size:
+            lo, hi = y.min(), y.max()
+            y0, y1 = self.ax.get_ylim()
+            if lo < y0 or hi > y1:
+                pad = (hi - lo) * self.ymargin or 1.0
+                # widen only the side(s) the data left
+                self.ax.set_ylim(y0 if lo >= y0 else lo - pad, y1 if hi <= y1 else hi + pad)
+                changed = True
+        if changed:
+            self.redraws += 1
+            self.ax.figure.canvas.draw()
+        return changed
+
+
+class MinMaxDecimator:
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.width = None           # seconds per bucket
+        self.reset()
+
+    def reset(self):
+        self.keys = np.empty(0, np.int64)               # bucket index = floor(t / width)
+        self.lo = np.empty((self.channels, 0))
+        self.hi = np.empty((self.channels, 0))
+        self.last_t = None
+
+    def update(self, tdata, ydata, span, pixels):
+        # (t, y) to plot for the window tdata/ydata (views, oldest first):
+        # the data itself while it has fewer than two samples per pixel
+        # column, otherwise two points (min, max) per column of span/pixels s
+        pixels = max(int(pixels), 1)
+        if len(tdata) <= 2 * pixels:
+            self.width = None
+            return tdata, ydata
+        width = span / pixels
+        if width != self.width or self.last_t is None or tdata[-1] < self.last_t:
+            self.width = width
+            self.reset()
+            new = 0
+        else:
+            new = int(np.searchsorted(tdata, self.last_t, 'right'))
+        if new < len(tdata):
+            self._fold(tdata[new:], ydata[:, new:])
+            self.last_t = tdata[-1]
+        # drop buckets that scrolled out of the window
+        first = int(np.searchsorted(self.keys, np.floor(tdata[0] / width), 'left'))
+        if first:
+            self.keys = self.keys[first:]
+            self.lo = self.lo[:, first:]
+            self.hi = self.hi[:, first:]
+        # the left edge cuts through the first bucket: rebuild it from its
+        # samples that are still in the window, so extremes that scrolled
+        # out do not stay drawn
+        end = int(np.searchsorted(tdata, (self.keys[0] + 1) * width, 'left'))
+        self.lo[:, 0] = ydata[:, :end].min(axis=1)
+        self.hi[:, 0] = ydata[:, :end].max(axis=1)
+        t = np.repeat((self.keys + 0.5) * width, 2)
+        t[:2] = max(t[0], tdata[0])
+        y = np.empty((self.channels, len(t)))
+        y[:, 0::2] = self.lo
+        y[:, 1::2] = self.hi
+        return t, y
+
+    def _fold(self, t, y):
+        keys = np.floor(t / self.width).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        keys = keys[starts]
+        lo = np.minimum.reduceat(y, starts, axis=1)
+        hi = np.maximum.reduceat(y, starts, axis=1)
+        if len(self.keys) and keys[0] == self.keys[-1]:
+            # the newest cached bucket was still filling
+            self.lo[:, -1] = np.minimum(self.lo[:, -1], lo[:, 0])
+            self.hi[:, -1] = np.maximum(self.hi[:, -1], hi[:, 0])
+            keys, lo, hi = keys[1:], lo[:, 1:], hi[:, 1:]
+        self.keys = np.concatenate([self.keys, keys])
+        self.lo = np.concatenate([self.lo, lo], axis=1)
+        self.hi = np.concatenate([self.hi, hi], axis=1)
+
+
+class FrameStats:
+
+    def __init__(self, name, every=10.0, out=print):
+        self.name = name
+        self.every = every
+        self.out = out
+        self.summary = None         # the last printed numbers, as a dict
+        self._reset(time.perf_counter())
+
+    def _reset(self, now):
+        self.since = now
+        self.frames = 0
+        self.busy = 0.0
+        self.worst = 0.0
+
+    def start(self):
+        self.t_start = time.perf_counter()
+
+    def stop(self, redraws=0):
+        now = time.perf_counter()
+        spent = now - self.t_start
+        self.frames += 1
+        self.busy += spent
+        self.worst = max(self.worst, spent)
+        if now - self.since >= self.every:
+            self.summary = {
+                'fps': self.frames / (now - self.since),
+                'frame_ms': self.busy / self.frames * 1e3,
+                'worst_ms': self.worst * 1e3,
+                'redraws': redraws,
+            }
+            if self.out is not None:
+                self.out(f"{self.name}: {self.summary['fps']:.1f} fps, frame {self.summary['frame_ms']:.2f} ms"
+                         f" (worst {self.summary['worst_ms']:.2f} ms), {redraws} full redraws")
+            self._reset(now)
+
+
+class Scope:
+
+    # labels defaults to "<legend_prefix> 1".."<legend_prefix> <modules>".
+    # With blit=True (for FuncAnimation(..., blit=True)) only the lines are
+    # redrawn per frame, the axes when the time axis jumps or data leaves
+    # the y band. FPS and frame time are printed every stats_every seconds
+    colors = ['r', 'g', 'm', 'b']
+
+    def __init__(self, ax, maxt=10, dt=0.1, modules=4, title="Power of Modules", ylabel="Power (W)",
+                 legend_prefix="Module", ylim=(0, 160), labels=None, blit=True, stats_every=10.0):
+        from matplotlib.lines import Line2D
+        self.ax = ax
+        self.blit = blit
+        self.axes = ScrollingAxes(ax, maxt)
+        self.stats = FrameStats(title, every=stats_every)
+        self.dt = dt
+        self.maxt = maxt
+        self.modules = modules
+        self.buffer = ScopeBuffer.for_window(maxt, dt, modules)
+        self.decimator = MinMaxDecimator(modules)
+        self.t0 = time.perf_counter()
+        if labels is None:
+            labels = [f'{legend_prefix} {i+1}' for i in range(modules)]
+        self.lines = [Line2D([], [], color=self.colors[i % len(self.colors)], label=labels[i]) for i in range(modules)]
+        for line in self.lines:
+            self.ax.add_line(line)
+        self.ax.set_ylim(ylim)
+        self.ax.set_xlim(0, self.maxt)
+        self.ax.set_title(title)
+        self.ax.set_xlabel("Time (s)")
+        self.ax.set_ylabel(ylabel)
+        self.ax.legend(loc='upper left')
+
+    def update(self, data):
+        # data is (t, values) for one sample or (ts, values[n, modules]) for a batch
+        t, values = data
+        if np.ndim(t):
+            self.buffer.extend(t, values)
+        else:
+            self.buffer.append(t, values)
+        if not self.buffer.count:
+            return self.lines
+        self.stats.start()
+        # views of the last maxt seconds, no copies
+        tdata, ydatas = self.buffer.window(self.buffer.window()[0][-1] - self.maxt)
+        # one min/max pair per pixel column once the window is denser than the screen
+        span = self.axes.span if self.blit else self.maxt
+        tplot, yplot = self.decimator.update(tdata, ydatas, span, self.ax.bbox.width)
+        for i, line in enumerate(self.lines):
+            line.set_data(tplot, yplot[i])
+        if self.blit:
+            self.axes.update(tplot, yplot)
+        else:
+            # FuncAnimation redraws the whole figure after every frame
+            self.ax.set_xlim(tdata[0], tdata[0] + self.maxt)
+        self.stats.stop(self.axes.redraws)
+        return self.lines
@@ -0,0 +1,366 @@
+#######################################################################
+# In-process stand-ins for the hardware buses
+#######################################################################
+
+# SimulatedPMBus has the same methods as smbus.SMBus and behaves like a
+# multi-page CoolX supply behind address 0x50, so power_supply and the tools
+# built on it can run (and be timed) on a machine without the supply attached:
+#
+#   ps = power_supply(0x50, bus=SimulatedPMBus(latency=0.0005))
+#
+# Every transaction sleeps for `latency` seconds and is counted in
+# `transactions` and `bytes` (bytes on the wire, address bytes included).
+# Commands the device does not implement are NACKed with OSError, as the
+# kernel driver reports them.
+#
+# SimulatedAD7124 plays the same role for the spidev.SpiDev that
+# larpix_monitor_vac_pressure drives: assign one to lmp.spi and
+# init_registers/read_tempers talk to a model AD7124-8 with four Pt100 RTDs.
+
+import errno
+import threading
+import time
+
+from supper_supp_modules import twos_comp
+
+VOUT_EXP = -8                       # VOUT_MODE exponent reported by the CoolX series
+
+
+def encode_linear11(value, exp=None):
+    # pick the smallest exponent that keeps the mantissa in 10 bits, so the
+    # mantissa is never negative (read_current treats it as unsigned)
+    if exp is None:
+        exp = -16
+        while abs(value) / 2 ** exp >= 1024 and exp < 15:
+            exp += 1
+    mantissa = int(round(value / 2 ** exp)) & 0x7FF
+    return ((exp & 0x1F) << 11) | mantissa
+
+
+def decode_linear11(data):
+    return twos_comp(data & 0x7FF, 11) * 2 ** twos_comp(data >> 11, 5)
+
+
+class SimulatedPMBus:
+
+    def __init__(self, pages=(1, 2, 3, 4), latency=0.0, page_plus=True, load_ohms=4.0,
+                 ambient=25.0, kelvin_per_watt=0.2, temp_exp=0):
+        self.latency = latency            # seconds added to every transaction
+        self.page_plus = page_plus        # False models a pre-1.2 device that NACKs 0x05/0x06
+        self.ambient = ambient
+        self.kelvin_per_watt = kelvin_per_watt
+        self.temp_exp = temp_exp          # TEMP1 exponent; 0 gives whole degrees C
+        self.transactions = 0
+        self.bytes = 0
+        self.page = pages[0]
+        self.lock = threading.Lock()      # one transaction at a time, like the i2c adapter
+        self.modules = {}
+        for page in pages:
+            self.modules[page] = {
+                'operation': 0x00,
+                'vout_command': 0,
+                'vout_max': 0xFFFF,
+                'iout_oc_fault_limit': encode_linear11(20.0),
+                'iout_oc_warn_limit': encode_linear11(18.0),
+                'ot_fault_limit': encode_linear11(100.0, 0),
+                'load_ohms': load_ohms,
+                'oc_fault': False,
+            }
+
+    # ---- physics ------------------------------------------------------
+
+    def _output(self, page):
+        module = self.modules[page]
+        if not module['operation'] & 0x80 or module['oc_fault']:
+            return 0.0, 0.0
+        vout = min(module['vout_command'], module['vout_max']) * 2 ** VOUT_EXP
+        iout = vout / module['load_ohms']
+        if iout > decode_linear11(module['iout_oc_fault_limit']):
+            module['oc_fault'] = True          # latch off until the next OPERATION write
+            return 0.0, 0.0
+        return vout, iout
+
+    def _status_word(self, page):
+        module = self.modules[page]
+        vout, iout = self._output(page)
+        status = 0
+        if vout == 0.0:
+            status |= 0x0040                   # OFF
+        if module['oc_fault']:
+            status |= 0x0010 | 0x4000          # IOUT_OC_FAULT, STATUS_IOUT set
+        elif iout > decode_linear11(module['iout_oc_warn_limit']):
+            status |= 0x4000
+        return status
+
+    # ---- registers ----------------------------------------------------
+
+    def _read(self, page, command):
+        if command == 0x00:
+            return self.page
+        if page not in self.modules:
+            # PAGE 0xFF selects every page for writes only; there is no single
+            # value to return, and the device NACKs the read
+            raise OSError(errno.EREMOTEIO, 'NACK')
+        module = self.modules[page]
+        if command == 0x01:
+            return module['operation']
+        if command == 0x20:
+            return VOUT_EXP & 0x1F                 # VOUT_MODE, linear format
+        if command == 0x21:
+            return module['vout_command']
+        if command == 0x24:
+            return module['vout_max']
+        if command == 0x46:
+            return module['iout_oc_fault_limit']
+        if command == 0x4A:
+            return module['iout_oc_warn_limit']
+        if command == 0x4F:
+            return module['ot_fault_limit']
+        if command == 0x79:
+            return self._status_word(page)
+        if command == 0x8B:                        # READ_VOUT, LINEAR16
+            return int(round(self._output(page)[0] / 2 ** VOUT_EXP))
+        if command == 0x8C:                        # READ_IOUT, LINEAR11
+            return encode_linear11(self._output(page)[1])
+        if command == 0x8D:                        # READ_TEMPERATURE_1, LINEAR11
+            vout, iout = self._output(page)
+            return encode_linear11(self.ambient + self.kelvin_per_watt * vout * iout, self.temp_exp)
+        if command == 0x98:
+            return 0x22 if self.page_plus else 0x11  # PMBUS_REVISION 1.2 / 1.1
+        raise OSError(errno.EREMOTEIO, 'NACK')
+
+    def _write(self, page, command, value):
+        module = self.modules[page]
+        if command == 0x01:
+            module['operation'] = value
+            module['oc_fault'] = False
+        elif command == 0x21:
+            module['vout_command'] = value
+        elif command == 0x24:
+            module['vout_max'] = value
+        elif command == 0x46:
+            module['iout_oc_fault_limit'] = value
+        elif command == 0x4A:
+            module['iout_oc_warn_limit'] = value
+        elif command == 0x4F:
+            module['ot_fault_limit'] = value
+        else:
+            raise OSError(errno.EREMOTEIO, 'NACK')
+
+    def _write_selected(self, command, value):
+        # PAGE 0xFF addresses every page at once
+        pages = self.modules if self.page == 0xFF else [self.page]
+        for page in pages:
+            self._write(page, command, value)
+
+    def _transaction(self, nbytes):
+        self.transactions += 1
+        self.bytes += nbytes
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _check_address(self, addr):
+        if addr != 0x50:
+            raise OSError(errno.ENXIO, 'no device at address')
+
+    # ---- SMBus interface ----------------------------------------------
+
+    def write_byte_data(self, addr, command, value):
+        with self.lock:
+            self._transaction(3)
+            self._check_address(addr)
+            if command == 0x00:
+                if value not in self.modules and value != 0xFF:
+                    raise OSError(errno.EREMOTEIO, 'NACK')
+                self.page = value
+            else:
+                self._write_selected(command, value)
+
+    def write_word_data(self, addr, command, value):
+        with self.lock:
+            self._transaction(4)
+            self._check_address(addr)
+            self._write_selected(command, value)
+
+    def read_byte_data(self, addr, command):
+        with self.lock:
+            self._transaction(4)
+            self._check_address(addr)
+            return self._read(self.page, command) & 0xFF
+
+    def read_word_data(self, addr, command):
+        with self.lock:
+            self._transaction(5)
+            self._check_address(addr)
+            return self._read(self.page, command) & 0xFFFF
+
+    def write_block_data(self, addr, command, data):
+        with self.lock:
+            self._transaction(3 + len(data))
+            self._check_address(addr)
+            if command != 0x05 or not self.page_plus:
+                raise OSError(errno.EREMOTEIO, 'NACK')
+            # PAGE_PLUS_WRITE: page, command, then one or two data bytes
+            page, inner = data[0], data[1]
+            if page not in self.modules:
+                raise OSError(errno.EREMOTEIO, 'NACK')
+            value = data[2] if len(data) == 3 else data[2] | (data[3] << 8)
+            self._write(page, inner, value)
+
+    def read_block_data(self, addr, command):
+        with self.lock:
+            self._transaction(4)
+            self._check_address(addr)
+            raise OSError(errno.EREMOTEIO, 'NACK')   # no block read commands modelled
+
+    def block_process_call(self, addr, command, data):
+        with self.lock:
+            self._check_address(addr)
+            if command != 0x06 or not self.page_plus:
+                self._transaction(4 + len(data))
+                raise OSError(errno.EREMOTEIO, 'NACK')
+            # PAGE_PLUS_READ: page, command in; byte count and data out
+            page, inner = data[0], data[1]
+            if page not in self.modules:
+                self._transaction(4 + len(data))
+                raise OSError(errno.EREMOTEIO, 'NACK')
+            value = self._read(page, inner)
+            reply = [value & 0xFF] if inner in (0x00, 0x01, 0x20, 0x98) else [value & 0xFF, value >> 8]
+            self._transaction(5 + len(data) + len(reply))
+            return reply
+
+    def close(self):
+        pass
+
+
+class SimulatedAD7124:
+
+    # AIN pairs (positive, negative) of the four RTDs, in read_tempers' sensor order
+    rtd_inputs = [(4, 3), (3, 2), (2, 1), (1, 0)]
+
+    def __init__(self, rtd_ohms=(109.7, 110.5, 111.2, 112.0), latency=0.0, model_clock=True,
+                 max_reliable_hz=2000000):
+        from larpix_monitor_vac_pressure import registers
+        self.widths = [r[1] for r in registers]
+        self.resets = [r[2] for r in registers]
+        self.regs = list(self.resets)
+        self.rtd_ohms = dict(zip(self.rtd_inputs, rtd_ohms))
+        self.latency = latency            # fixed seconds added to every xfer2
+        self.model_clock = model_clock    # also add the wire time at max_speed_hz
+        self.max_reliable_hz = max_reliable_hz  # faster clocks garble replies, like long wiring
+        self.max_speed_hz = 50000
+        self.mode = 0
+        self.transactions = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self._restart(time.monotonic())
+
+    # ---- spidev interface ---------------------------------------------
+
+    def open(self, bus, device):
+        pass
+
+    def close(self):
+        pass
+
+    def xfer2(self, msg):
+        with self.lock:
+            self.transactions += 1
+            self.bytes += len(msg)
+            delay = self.latency
+            if self.model_clock and self.max_speed_hz:
+                delay += len(msg) * 8 / self.max_speed_hz
+            if delay:
+                time.sleep(delay)
+            now = time.monotonic()
+            if len(msg) >= 8 and all(b == 0xFF for b in msg):
+                self.regs = list(self.resets)          # 64 ones reset the serial interface
+                self._restart(now)
+                return [0xFF] * len(msg)
+            # one transfer may carry several register operations back to back
+            reply = []
+            i = 0
+            while i < len(msg):
+                comms = msg[i]
+                address = comms & 0x3F
+                if address >= len(self.widths):
+                    reply += [0] * (len(msg) - i)
+                    break
+                nbytes = self.widths[address] // 8
+                if comms & 0x40:
+                    value, nbytes = self._read(address, now)
+                    out = list(value.to_bytes(nbytes, 'big'))
+                    if self.max_speed_hz > self.max_reliable_hz:
+                        out = [(b >> 1) | 0x80 for b in out]     # sampled a bit late
+                    reply += [0] + out
+                else:
+                    data = msg[i + 1:i + 1 + nbytes]
+                    reply += [0] * (1 + len(data))
+                    self._write(address, int.from_bytes(bytes(data), 'big'), now)
+                i += 1 + nbytes
+            return reply[:len(msg)]
+
+    # ---- conversions --------------------------------------------------
+
+    def _enabled_channels(self):
+        return [ch for ch in range(16) if self.regs[0x09 + ch] & 0x8000]
+
+    def _conversion_time(self):
+        # sinc4 at full power: ODR = 19200/FS, and a channel settles after 4 periods
+        fs = self.regs[0x21] & 0x7FF or 1
+        return 4 * fs / 19200
+
+    def _restart(self, now):
+        channels = self._enabled_channels()
+        self.channel = channels[0] if channels else 0
+        self.result = None
+        self.result_channel = 0
+        self.ready_at = now + self._conversion_time()
+
+    def _advance(self, now):
+        # finish every conversion due by now; the sequencer steps through the
+        # enabled channels and the newest result overwrites DATA
+        channels = self._enabled_channels()
+        if not channels:
+            return
+        while now >= self.ready_at:
+            self.result = self._code(self.channel)
+            self.result_channel = self.channel
+            later = [ch for ch in channels if ch > self.channel]
+            self.channel = later[0] if later else channels[0]
+            self.ready_at += self._conversion_time()
+
+    def _code(self, channel):
+        # inverse of lmp.code_to_resistance
+        from larpix_monitor_vac_pressure import adc_910, adc_429
+        reg = self.regs[0x09 + channel]
+        pair = ((reg >> 5) & 0x1F, reg & 0x1F)
+        ohms = self.rtd_ohms.get(pair, 0.0)
+        code = adc_910 + (ohms - 199.5) * (adc_429 - adc_910) / (29.98 - 199.5)
+        return max(0, min(0xFFFFFF, int(round(code))))
+
+    def _status(self):
+        rdy = 0x00 if self.result is not None else 0x80
+        return rdy | (self.result_channel & 0x0F)
+
+    def _read(self, address, now):
+        self._advance(now)
+        nbytes = self.widths[address] // 8
+        if address == 0x00:
+            return self._status(), nbytes
+        if address == 0x02:
+            code = self.result if self.result is not None else self.regs[0x02]
+            status = self._status()
+            self.regs[0x02] = code
+            self.result = None                    # reading DATA clears RDY
+            if self.regs[0x01] & 0x0400:          # DATA_STATUS appends STATUS to DATA
+                return (code << 8) | status, nbytes + 1
+            return code, nbytes
+        return self.regs[address], nbytes
+
+    def _write(self, address, value, now):
+        if address in (0x00, 0x02, 0x05, 0x06, 0x08):
+            return                                # read-only registers
+        self.regs[address] = value
+        if address == 0x01 or 0x09 <= address <= 0x18 or 0x19 <= address <= 0x28:
+            self._restart(now)                    # mode, channel or setup changes restart the ADC
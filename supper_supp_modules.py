@@ -1,12 +1,16 @@
-from smbus import SMBus   # pmbus command library
 #import math
 import sys
 import time
 import csv
 from datetime import datetime
 import threading
+from collections import namedtuple
+from bus_worker import BusWorker
 
 
+# one consistent sample of a module: t is time.monotonic() when the reads finished
+ModuleSnapshot = namedtuple('ModuleSnapshot', ['page', 't', 'temp', 'voltage', 'current', 'power', 'status'])
+
 def twos_comp(val, bits):
         if (val & (1 << (bits - 1))) != 0:
                 val = val - (1 << bits)
@@ -14,68 +18,143 @@ def twos_comp(val, bits):
  
 class power_supply:
 
-	def __init__(self, addr, id=1):
-		self.bus = SMBus(id)
+	def __init__(self, addr, id=1, cache_page=True, transport='auto', bus=None):
+		if bus is None:                            #e.g. simulated_bus.SimulatedPMBus() when no supply is attached
+			from smbus import SMBus   # pmbus command library
+			bus = SMBus(id)
+		self.bus = bus
 		self.address = addr
 		self.valid_pages = [1, 2, 3, 4] #valid modules to page to assuming 1,2,3 correspond to modules J1012, J1008, J1009 respectively. Should check and adjust as needed
-
-	def set_page(self, page):
+		self.cache_page = cache_page    #set False when another process also writes PAGE on this device
+		self.current_page = None        #page last written to the device, None when unknown
+		self.page_writes_skipped = 0    #number of PAGE writes dropped because the page was already selected
+		self.publishers = []            #objects with publish_snapshot(snap), e.g. telemetry_shm.TelemetryShm, handed every snapshot
+		#'page' selects with a PAGE write before each command, 'page_plus' sends the page
+		#inside PAGE_PLUS_WRITE/PAGE_PLUS_READ, 'auto' asks the device which one it supports
+		if transport == 'auto':
+			transport = self.probe_transport()
+		if transport not in ('page', 'page_plus'):
+			raise ValueError(f"Invalid transport {transport}.")
+		self.transport = transport
+
+	def probe_transport(self):
+		# PAGE_PLUS_WRITE (0x05) and PAGE_PLUS_READ (0x06) exist from PMBus 1.2 on.
+		# Check PMBUS_REVISION, then confirm with a real PAGE_PLUS_READ of VOUT_MODE.
+		# Any NACK or an smbus without block process calls falls back to 'page'
+		page = self.valid_pages[0]
+		try:
+			revision = self.bus.read_byte_data(self.address, 0x98)
+			if revision & 0x0F < 2:                    #bits 3:0 are the Part II revision
+				return 'page'
+			reply = self.bus.block_process_call(self.address, 0x06, [page, 0x20])
+		except (OSError, AttributeError):
+			return 'page'
+		return 'page_plus' if len(reply) == 1 else 'page'
+
+	def check_page(self, page):
 		if page not in self.valid_pages:
 			raise ValueError(f"Invalid module page {page}.")
-		self.bus.write_byte_data(self.address, 0x00, page)
+
+	def set_page(self, page):
+		self.check_page(page)
+		if self.cache_page and page == self.current_page:
+			self.page_writes_skipped += 1
+			return
+		try:
+			self.bus.write_byte_data(self.address, 0x00, page)
+		except OSError:
+			self.invalidate_page()
+			raise
+		self.current_page = page
 	#	print(f"PAGE set to Module {page}")  
 
+	def invalidate_page(self):
+		# forget the cached page, e.g. after a bus error or when another process
+		# may have written PAGE, so the next access writes it again
+		self.current_page = None
+
+	# bus accessors: run one command on a page. In 'page' mode the page is selected
+	# first, and any bus error leaves the device page unknown, so the cache is dropped
+	# before re-raising. In 'page_plus' mode the page travels with the command and
+	# the PAGE register is never touched
+	def _write_byte(self, page, command, value):
+		if self.transport == 'page_plus':
+			self.check_page(page)
+			self.bus.write_block_data(self.address, 0x05, [page, command, value])
+			return
+		self.set_page(page)
+		try:
+			self.bus.write_byte_data(self.address, command, value)
+		except OSError:
+			self.invalidate_page()
+			raise
+
+	def _write_word(self, page, command, value):
+		if self.transport == 'page_plus':
+			self.check_page(page)
+			self.bus.write_block_data(self.address, 0x05, [page, command, value & 0xFF, value >> 8])
+			return
+		self.set_page(page)
+		try:
+			self.bus.write_word_data(self.address, command, value)
+		except OSError:
+			self.invalidate_page()
+			raise
+
+	def _read_word(self, page, command):
+		if self.transport == 'page_plus':
+			self.check_page(page)
+			data = self.bus.block_process_call(self.address, 0x06, [page, command])
+			return data[0] | (data[1] << 8)            #PMBus words are sent low byte first
+		self.set_page(page)
+		try:
+			return self.bus.read_word_data(self.address, command)
+		except OSError:
+			self.invalidate_page()
+			raise
+
 	def on_mod(self, page):                              #turns on power supply with 0x80
-		self.set_page(page)		
-		self.bus.write_byte_data(self.address, 0x01, 0x80)  
+		self._write_byte(page, 0x01, 0x80)  
 		print(f"Module {page} is ON")
 
 	def off_mod(self, page):                              #turns off power supply with 0x00
-		self.set_page(page)
-		self.bus.write_byte_data(self.address, 0x01, 0x00)  
+		self._write_byte(page, 0x01, 0x00)  
 		print(f"Module {page} is OFF")
 
 	def set_voltage(self, page, voltage):                    #sets output voltage
-		self.set_page(page)	
 		exp = -8                                   #exponent typically used in CoolX series, pg 14 of manual, and exp value can be found using VOUT_MODE command
 		vout_command = int(voltage * (2 ** -exp))  #converts voltage to format for PMBus
-		self.bus.write_word_data(self.address, 0x21, vout_command)  #sends 16-bit voltage command to vout command (0x21)
+		self._write_word(page, 0x21, vout_command)  #sends 16-bit voltage command to vout command (0x21)
 		print(f"Voltage for Module {page} set to {voltage}V")
 
 	def read_voltage(self, page):
-		self.set_page(page)
-		exp = -8
-		data = self.bus.read_word_data(self.address, 0x8B)
-		voltage = data * (2 ** exp)
-		return voltage
+		data = self._read_word(page, 0x8B)
+		return decode_vout(data)
 
 	def read_temperature(self, page):
-		self.set_page(page)
-		data = self.bus.read_word_data(self.address, 0x8D) #reading from 0x8D whihc is temp1 (from manual)
+		data = self._read_word(page, 0x8D) #reading from 0x8D whihc is temp1 (from manual)
 		temp = data
 		return temp
 
 	def set_temp_fault_lim(self, page, limit):
-		self.set_page(page)
 		exp = 0
 		temp_com = int(limit * (2 ** exp))
-		self.bus.write_word_data(self.address, 0x4F, temp_com)
+		self._write_word(page, 0x4F, temp_com)
 
 	def set_current_limit(self, page, current_limit):
-		self.set_page(page)
 		exp = -8
 		current_val = int(current_limit * (2 ** -exp))
-		self.bus.write_word_data(self.address, 0x24, current_val)
+		self._write_word(page, 0x24, current_val)
 
 	def read_current(self, page):
-		self.set_page(page)
-		data = self.bus.read_word_data(self.address, 0x8C)
-		exp = twos_comp( data // 2**11, 5 )
-		cur = data % 2**11
-		current = cur * (2 ** exp)
-		return current
+		data = self._read_word(page, 0x8C)
+		return decode_iout(data)
+
+	def read_status(self, page):
+		return self._read_word(page, 0x79)            #STATUS_WORD
 
 	def close(self):
+		self.invalidate_page()
 		self.bus.close()
 
 	def adjust_voltage(self, page, voltage, increment = 0.1):
@@ -83,14 +162,38 @@ class power_supply:
 		self.set_voltage(page, current_voltage + increment)
 
 	def read_power(self, page):
-		self.set_page(page)
 		voltage = self.read_voltage(page)
 		current = self.read_current(page)
 		power = current * voltage
 		return power
 
-import numpy as np
+	def snapshot(self, page):
+		# select the page once and read VOUT, IOUT, TEMP1 and STATUS_WORD once each,
+		# so power is computed from the same V and I that are reported with it
+		voltage = decode_vout(self._read_word(page, 0x8B))
+		current = decode_iout(self._read_word(page, 0x8C))
+		temp = self._read_word(page, 0x8D)
+		status = self._read_word(page, 0x79)
+		snap = ModuleSnapshot(page, time.monotonic(), temp, voltage, current, voltage * current, status)
+		for publisher in self.publishers:
+			publisher.publish_snapshot(snap)
+		return snap
+
+	def snapshot_all(self, pages):
+		return [self.snapshot(page) for page in pages]
+
+def decode_vout(data):
+	exp = -8                                   #VOUT_MODE exponent of the CoolX series, see set_voltage
+	return data * (2 ** exp)
+
+def decode_iout(data):                             #LINEAR11: 5-bit exponent, 11-bit mantissa
+	exp = twos_comp( data // 2**11, 5 )
+	cur = data % 2**11
+	return cur * (2 ** exp)
+
 """	
+import numpy as np
+
 class power_adjust:
 
 	def __init__(self, modules, sleep_dt=1, n_samples=20):
@@ -152,9 +255,14 @@ class power_adjust:
 #				self.set_voltage(page, self.read_voltage(page) - 2)
 #		time.sleep(5)
 
-def mod_log(modules, filename, interval = 5):
-	addr = 0x50
-	power_supp = power_supply(addr)
+#backend 'csv' writes filename as a CSV file, 'binary' writes fixed-width records
+#into rotated segments in the directory filename (see telemetry_log.py)
+def mod_log(modules, filename, interval = 5, worker = None, backend = 'csv'):
+	if worker is None:
+		addr = 0x50
+		worker = BusWorker(power_supply(addr))
+	if backend == 'binary':
+		return mod_log_binary(modules, filename, interval, worker)
 	
 	with open(filename, 'w', newline = '') as csvfile:
 		csvwriter = csv.writer(csvfile)
@@ -170,80 +278,103 @@ def mod_log(modules, filename, interval = 5):
 				now = datetime.now()
 				timestamp = now.strftime('%d-%m-%Y  %H:%M:%S')
 				data = []
-				for page in modules:
-					temp = power_supp.read_temperature(page)
-					voltage = power_supp.read_voltage(page)
-					current = power_supp.read_current(page)
-					power = power_supp.read_power(page)
-					data.append(temp)
-					data.append(voltage)
-					data.append(current)
-					data.append(power)
-					#print(f"Module {page}: {temp} °C, {voltage} V, {current} A, {power} W")
+				#queue the whole row at telemetry priority, then wait for it
+				futures = worker.snapshot_all(modules)
+				for snap in [f.result() for f in futures]:
+					data.append(snap.temp)
+					data.append(snap.voltage)
+					data.append(snap.current)
+					data.append(snap.power)
+					#print(f"Module {snap.page}: {snap.temp} °C, {snap.voltage} V, {snap.current} A, {snap.power} W")
 				csvwriter.writerow([timestamp] + data)
 				csvfile.flush()
 				time.sleep(interval)
 		except KeyboardInterrupt:
-			power_supp.close()
+			worker.stop()
+			worker.device.close()
+
+def mod_log_binary(modules, directory, interval, worker):
+	from telemetry_log import TelemetryWriter
+	channels = []
+	for page in modules:
+		channels += [f"Module {page} Temp", f"Module {page} Voltage", f"Module {page} Current", f"Module {page} Power"]
+	with TelemetryWriter(directory, channels, prefix = 'module_log', meta = {'interval': interval}) as log:
+		try:
+			while True:
+				t_ns = time.time_ns()
+				data = []
+				for snap in [f.result() for f in worker.snapshot_all(modules)]:
+					data += [snap.temp, snap.voltage, snap.current, snap.power]
+				log.append(data, t_ns)
+				time.sleep(interval)
+		except KeyboardInterrupt:
+			worker.stop()
+			worker.device.close()
 			
-#0x50 is slave address for 1010000 of A6 through A0 (see table 2 in pmbus manual)
-addr = 0x50   #the default slave address = 1010000 = 0x50
-power_supp = power_supply(addr)
-#signal.signal(signal.SIGINT, Ctrl_C_signal)
-mods = [1, 2, 3, 4]
-log_file = "module_log.csv"	
-#mod_log(mods, log_file, interval = 5)	
-thread_log = threading.Thread(target = mod_log, args = (mods, log_file, 5))
-thread_log.start()
-
-
-try:
-	while True:
-		user_input = input("type 'on' to turn on power supply module, 'off' to turn off module, 'set volt' to set the voltage, 'set current' to set the current, 'read volt' to read the voltage, 'read temp' to read the temp, 'read power' to read the power, 'quit' to exit the program: ")
-		
-		if user_input in ['on', 'off', 'set volt', 'set current', 'read volt', 'read power', 'read temp', 'quit']:
-			page = int(input("Select module (1,2,4): "))
-
-			if user_input == 'on':
-				power_supp.on_mod(page)
+if __name__ == '__main__':
+	#0x50 is slave address for 1010000 of A6 through A0 (see table 2 in pmbus manual)
+	addr = 0x50   #the default slave address = 1010000 = 0x50
+	bus = None
+	if '--simulate' in sys.argv:                   #run against the in-process simulator instead of SMBus(1)
+		from simulated_bus import SimulatedPMBus
+		bus = SimulatedPMBus(latency = 0.001)
+	power_supp = power_supply(addr, bus = bus)
+	#the worker thread is the only user of the bus; CLI writes jump ahead of logger reads
+	worker = BusWorker(power_supp)
+	#signal.signal(signal.SIGINT, Ctrl_C_signal)
+	mods = [1, 2, 3, 4]
+	log_file = "module_log.csv"	
+	backend = 'csv'
+	if '--binary' in sys.argv:                     #binary segments in module_log/, export with telemetry_log.py
+		log_file = "module_log"
+		backend = 'binary'
+	#mod_log(mods, log_file, interval = 5)	
+	thread_log = threading.Thread(target = mod_log, args = (mods, log_file, 5, worker, backend), daemon = True)
+	thread_log.start()
+
+
+	try:
+		while True:
+			user_input = input("type 'on' to turn on power supply module, 'off' to turn off module, 'set volt' to set the voltage, 'set current' to set the current, 'read volt' to read the voltage, 'read temp' to read the temp, 'read power' to read the power, 'quit' to exit the program: ")
 
-			elif user_input == 'off':
-				power_supp.off_mod(page)
+			if user_input in ['on', 'off', 'set volt', 'set current', 'read volt', 'read power', 'read temp', 'quit']:
+				page = int(input("Select module (1,2,4): "))
 
-			elif user_input == 'set volt':
-				voltage = float(input("Enter the desired voltage: "))
-				power_supp.set_voltage(page, voltage)
-		
-			elif user_input == 'set current':
-				current_limit = float(input("Enter the current limit: "))
-				power_supp.set_current_limit(page, current_limit)		
-		
-			elif user_input == 'read volt':
-				voltage = power_supp.read_voltage(page)
-				print(f"Current Voltage is {voltage} V")		
+				if user_input == 'on':
+					worker.on_mod(page).result()
 
-			elif user_input == 'quit':
-				print("Exiting...")
-				break
+				elif user_input == 'off':
+					worker.off_mod(page).result()
 
-			elif user_input == 'read temp':
-				temp = power_supp.read_temperature(page)
-				print(f"Current temp of module {page} is {temp} °C")
-				
-			elif user_input == 'read power':
-				power = power_supp.read_power(page)
-				print(f"Current temp of module {page} is {power} W")
-				
-		else:	
-			print("invalid command. enter 'on', 'off', 'set volt', 'read volt', 'read temp', 'quit'.")
+				elif user_input == 'set volt':
+					voltage = float(input("Enter the desired voltage: "))
+					worker.set_voltage(page, voltage).result()
 
-finally:  
-	for page in power_supp.valid_pages:
-		power_supp.off_mod(page)
-	power_supp.close()
+				elif user_input == 'set current':
+					current_limit = float(input("Enter the current limit: "))
+					worker.set_current_limit(page, current_limit).result()		
 
+				elif user_input == 'read volt':
+					voltage = worker.snapshot(page).result().voltage
+					print(f"Current Voltage is {voltage} V")		
 
+				elif user_input == 'quit':
+					print("Exiting...")
+					break
 
+				elif user_input == 'read temp':
+					temp = worker.snapshot(page).result().temp
+					print(f"Current temp of module {page} is {temp} °C")
 
+				elif user_input == 'read power':
+					power = worker.snapshot(page).result().power
+					print(f"Current power of module {page} is {power} W")
 
+			else:	
+				print("invalid command. enter 'on', 'off', 'set volt', 'read volt', 'read temp', 'quit'.")
 
+	finally:  
+		for future in [worker.off_mod(page) for page in power_supp.valid_pages]:
+			future.result()
+		worker.stop()
+		power_supp.close()
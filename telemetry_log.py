@@ -0,0 +1,260 @@
+#######################################################################
+# Append-only binary telemetry log in rotated segment files
+#######################################################################
+
+# Each segment is one file: an 8 byte magic, a 4 byte little-endian header
+# length, a JSON header with the schema, padding to a multiple of 8 bytes,
+# and then fixed-width records of an int64 timestamp in ns since the epoch
+# followed by one float32 per channel. Writing a record is one struct.pack
+# and a buffered write; the file is flushed at most every flush_interval
+# seconds. A segment is sealed once it reaches max_bytes or spans
+# max_seconds, and with compress=True sealed segments are gzipped in the
+# background. Readers open a segment as a NumPy structured array, zero-copy
+# through np.memmap for plain segments. A crash can only leave a partial
+# record at the end of the newest segment, and readers ignore it.
+#
+# CSV is an offline export, e.g.
+#
+#   python telemetry_log.py export module_log module_log.csv
+#   python telemetry_log.py info module_log
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import shutil
+import struct
+import threading
+import time
+from datetime import datetime
+
+MAGIC = b'TLOG\x00\x01\r\n'
+SUFFIX = '.tlog'
+VERSION = 1
+
+
+def segment_name(prefix, start_ns):
+    # zero padded so the names sort in time order
+    return f'{prefix}-{start_ns:019d}{SUFFIX}'
+
+
+def record_struct(channels):
+    return struct.Struct('<q' + 'f' * len(channels))
+
+
+def encode_header(channels, start_ns, meta=None):
+    schema = {
+        'version': VERSION,
+        'channels': list(channels),
+        'timestamp': 'int64 ns since epoch',
+        'value': 'float32',
+        'start_ns': start_ns,
+        'meta': meta or {},
+    }
+    body = json.dumps(schema).encode()
+    head = MAGIC + struct.pack('<I', len(body)) + body
+    return head + b'\0' * (-len(head) % 8)
+
+
+def decode_header(head):
+    # returns (schema, offset of the first record)
+    if head[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a telemetry log segment')
+    n, = struct.unpack_from('<I', head, len(MAGIC))
+    start = len(MAGIC) + 4
+    schema = json.loads(head[start:start + n])
+    offset = start + n
+    return schema, offset + (-offset % 8)
+
+
+def read_header(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        head = f.read(len(MAGIC) + 4)
+        if len(head) < len(MAGIC) + 4:
+            raise ValueError('truncated telemetry log segment')
+        n, = struct.unpack_from('<I', head, len(MAGIC))
+        return decode_header(head + f.read(n))
+
+
+class TelemetryWriter:
+
+    def __init__(self, directory, channels, prefix='telemetry', max_bytes=64 * 2**20,
+                 max_seconds=24 * 3600, compress=False, flush_interval=1.0, meta=None):
+        self.directory = directory
+        self.channels = list(channels)
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.meta = meta
+        self.record = record_struct(self.channels)
+        self.file = None
+        self.path = None
+        self.segment_start = None
+        self.size = 0
+        self.last_flush = 0.0
+        self.records = 0
+        self.compressors = []
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_segment(self, t_ns):
+        self.path = os.path.join(self.directory, segment_name(self.prefix, t_ns))
+        self.file = open(self.path, 'xb')
+        head = encode_header(self.channels, t_ns, self.meta)
+        self.file.write(head)
+        self.size = len(head)
+        self.segment_start = t_ns
+
+    def append(self, values, t_ns=None):
+        # values: one number per channel, in schema order
+        if t_ns is None:
+            t_ns = time.time_ns()
+        if self.file is not None and (self.size >= self.max_bytes or
+                                      t_ns - self.segment_start >= self.max_seconds * 1e9):
+            self.rotate()
+        if self.file is None:
+            self._open_segment(t_ns)
+        self.file.write(self.record.pack(t_ns, *values))
+        self.size += self.record.size
+        self.records += 1
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.file.flush()
+            self.last_flush = now
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def rotate(self):
+        # seal the current segment; the next append opens a new one
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if self.compress:
+            thread = threading.Thread(target=compress_segment, args=(self.path,),
+                                      name='telemetry-gzip', daemon=True)
+            thread.start()
+            self.compressors = [t for t in self.compressors if t.is_alive()] + [thread]
+
+    def close(self):
+        self.rotate()
+        for thread in self.compressors:
+            thread.join()
+        self.compressors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def compress_segment(path):
+    # gzip a sealed segment next to itself, then drop the original; readers
+    # prefer the plain file while both exist
+    tmp = path + '.gz.tmp'
+    with open(path, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 2**20)
+    os.replace(tmp, path + '.gz')
+    os.remove(path)
+
+
+def list_segments(directory, prefix=None):
+    # segment paths in time order, plain or gzipped; prefix=None takes every
+    # segment in the directory
+    found = {}
+    for name in os.listdir(directory):
+        if prefix is not None and not name.startswith(prefix + '-'):
+            continue
+        if name.endswith(SUFFIX):
+            found[name] = os.path.join(directory, name)
+        elif name.endswith(SUFFIX + '.gz'):
+            found.setdefault(name[:-3], os.path.join(directory, name))
+    return [found[name] for name in sorted(found)]
+
+
+def record_dtype(channels):
+    import numpy as np
+    return np.dtype([('t', '<i8')] + [(name, '<f4') for name in channels])
+
+
+def open_segment(path):
+    # the records of one segment as a structured array with a 't' field and
+    # one field per channel: a read-only memmap for plain segments, an
+    # in-memory array for gzipped ones
+    import numpy as np
+    schema, offset = read_header(path)
+    dtype = record_dtype(schema['channels'])
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            data = f.read()[offset:]
+        return np.frombuffer(data, dtype, len(data) // dtype.itemsize)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count <= 0:
+        return np.empty(0, dtype)
+    return np.memmap(path, dtype, 'r', offset, (count,))
+
+
+def export_csv(directory, out, prefix=None, time_format='%d-%m-%Y  %H:%M:%S'):
+    # write every record as a CSV row in the layout mod_log used to write.
+    # The CSV has one header, so every segment must have the same channels;
+    # otherwise ValueError is raised before anything is written
+    paths = list_segments(directory, prefix)
+    channels = None
+    for path in paths:
+        names = read_header(path)[0]['channels']
+        if channels is None:
+            channels, first = names, path
+        elif names != channels:
+            raise ValueError(f'{os.path.basename(path)} has channels {names}, but '
+                             f'{os.path.basename(first)} has {channels}; one CSV header cannot cover both')
+    rows = 0
+    with open(out, 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        if channels is not None:
+            csvwriter.writerow(['Time'] + channels)
+        for path in paths:
+            records = open_segment(path)
+            for record in records:
+                timestamp = datetime.fromtimestamp(int(record['t']) / 1e9).strftime(time_format)
+                csvwriter.writerow([timestamp] + [float(record[name]) for name in channels])
+                rows += 1
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect or export a binary telemetry log')
+    sub = parser.add_subparsers(dest='command', required=True)
+    info = sub.add_parser('info', help='list segments, their channels and record counts')
+    info.add_argument('directory')
+    info.add_argument('--prefix', help='only segments written with this prefix')
+    export = sub.add_parser('export', help='convert all segments to one CSV file')
+    export.add_argument('directory')
+    export.add_argument('out')
+    export.add_argument('--prefix', help='only segments written with this prefix')
+    export.add_argument('--time-format', default='%d-%m-%Y  %H:%M:%S')
+    args = parser.parse_args(argv)
+
+    if args.command == 'info':
+        for path in list_segments(args.directory, args.prefix):
+            records = open_segment(path)
+            span = ''
+            if len(records):
+                span = f"{datetime.fromtimestamp(records['t'][0] / 1e9)} .. {datetime.fromtimestamp(records['t'][-1] / 1e9)}"
+            print(f'{os.path.basename(path)}: {len(records)} records, '
+                  f'{len(records.dtype.names) - 1} channels {span}')
+    else:
+        try:
+            rows = export_csv(args.directory, args.out, args.prefix, args.time_format)
+        except ValueError as e:
+            parser.exit(1, f'{e}\n')
+        print(f'{rows} rows written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
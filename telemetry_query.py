@@ -0,0 +1,251 @@
+#######################################################################
+# Read a time range of telemetry without loading the whole log
+#######################################################################
+
+# query() reads a time range out of a telemetry_log directory. Segment
+# files are named after their first timestamp, so a bisect over the names
+# finds the segments that overlap the range. Inside each memmapped segment
+# np.searchsorted on the sorted timestamps finds the records, and only
+# those pages are read from disk. Gzipped segments still have to be
+# decompressed as a whole. Names only sort by time within one log, so a
+# directory holding several logs needs the prefix of the one to read.
+# query_ns() takes the range in ns, as stored, with no float round trip.
+#
+# query_csv() does the same for mod_log CSV files. It bisects on byte
+# offsets: seek, resync to the next line, parse that line's day-first
+# timestamp. Only O(log n) lines plus the lines in the window are parsed.
+# Several rotated CSV files can be given in any order.
+#
+#   python telemetry_query.py module_log --start 2026-10-18T14:00 --end 2026-10-18T14:10 \
+#       --channels "Module 4 Power" "Module 4 Temp"
+#   python telemetry_query.py module_log.csv --start 2026-10-18T14:00 --minutes 10 --out window.npz
+
+import argparse
+import bisect
+import csv
+import io
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import telemetry_log as tl
+
+CSV_TIME_FORMAT = '%d-%m-%Y  %H:%M:%S'      # as written by supper_supp_modules.mod_log
+
+
+def to_ns(when):
+    # datetime (naive is local time), epoch seconds or an ISO string -> ns since epoch
+    if isinstance(when, str):
+        try:
+            when = float(when)
+        except ValueError:
+            when = datetime.fromisoformat(when)
+    if isinstance(when, datetime):
+        when = when.timestamp()
+    return int(round(when * 1e9))
+
+
+def segment_start(path):
+    # the first timestamp of a segment, from its file name
+    name = os.path.basename(path)
+    return int(name[name.rindex('-') + 1:name.index(tl.SUFFIX)])
+
+
+def segment_prefix(path):
+    name = os.path.basename(path)
+    return name[:name.rindex('-')]
+
+
+def query(directory, start, end, channels=None, prefix=None):
+    # records with start <= t <= end as a structured array with a 't' field
+    # (int64 ns) and one float32 field per requested channel, in time order.
+    # start and end are datetimes, epoch seconds or ISO strings. prefix may
+    # only be left out when the directory holds a single log
+    return query_ns(directory, to_ns(start), to_ns(end), channels, prefix)
+
+
+def query_ns(directory, start, end, channels=None, prefix=None):
+    # query() with start and end already in ns since the epoch
+    segments = tl.list_segments(directory, prefix)
+    prefixes = sorted({segment_prefix(path) for path in segments})
+    if len(prefixes) > 1:
+        # segment names only sort by time within one log
+        raise ValueError(f'{directory} holds several logs ({", ".join(prefixes)}); give a prefix')
+    starts = [segment_start(path) for path in segments]
+    # the segment holding `start` is the last one that begins at or before it
+    first = max(bisect.bisect_right(starts, start) - 1, 0)
+    last = bisect.bisect_right(starts, end)
+    parts = []
+    names = None
+    for path in segments[first:last]:
+        records = tl.open_segment(path)
+        # every segment must have the channels asked for (or, with none
+        # asked for, the same channels as the first one)
+        if channels is not None:
+            missing = [name for name in channels if name not in records.dtype.names[1:]]
+            if missing:
+                raise ValueError(f'{os.path.basename(path)} has no channel {", ".join(missing)}')
+        elif names is None:
+            names, first_path = records.dtype.names[1:], path
+        elif records.dtype.names[1:] != names:
+            raise ValueError(f'{os.path.basename(path)} has channels {list(records.dtype.names[1:])}, but '
+                             f'{os.path.basename(first_path)} has {list(names)}; give channels')
+        t = records['t']
+        lo = np.searchsorted(t, start, 'left')
+        hi = np.searchsorted(t, end, 'right')
+        if hi > lo:
+            parts.append(records[lo:hi])
+    if channels is None:
+        if parts:
+            channels = list(parts[0].dtype.names[1:])
+        elif segments:
+            channels = tl.read_header(segments[0])[0]['channels']
+        else:
+            channels = []
+    dtype = tl.record_dtype(channels)
+    out = np.empty(sum(len(part) for part in parts), dtype)
+    i = 0
+    for part in parts:
+        for name in dtype.names:
+            out[name][i:i + len(part)] = part[name]
+        i += len(part)
+    return out
+
+
+def _csv_time(line, time_format):
+    return to_ns(datetime.strptime(line.split(b',', 1)[0].decode(), time_format))
+
+
+def _line_at(f, pos, data_start):
+    # start offset of the first line that begins at or after pos
+    if pos <= data_start:
+        f.seek(data_start)
+    else:
+        f.seek(pos - 1)
+        f.readline()
+    return f.tell()
+
+
+def csv_offset(f, start, data_start, time_format=CSV_TIME_FORMAT):
+    # byte offset of the first complete line with t >= start (ns) in a CSV
+    # file opened in binary mode whose rows begin at data_start
+    lo, hi = data_start, os.fstat(f.fileno()).st_size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        _line_at(f, mid, data_start)
+        line = f.readline()
+        if not line.endswith(b'\n') or _csv_time(line, time_format) >= start:
+            hi = mid
+        else:
+            lo = mid + 1
+    return _line_at(f, lo, data_start)
+
+
+def csv_last_time(f, data_start, time_format=CSV_TIME_FORMAT):
+    # timestamp (ns) of the last complete line, None if there is none yet
+    size = os.fstat(f.fileno()).st_size
+    block = 4096
+    while True:
+        pos = max(data_start, size - block)
+        f.seek(pos)
+        lines = f.read(size - pos).split(b'\n')[:-1]
+        if pos > data_start:
+            lines = lines[1:]               # may start mid-line
+        if lines:
+            return _csv_time(lines[-1], time_format)
+        if pos == data_start:
+            return None
+        block *= 2
+
+
+def _csv_window(path, start, end, time_format):
+    # (channel names, timestamps, rows) of one CSV file with start <= t <= end
+    with open(path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode()]))
+        f.seek(csv_offset(f, start, f.tell(), time_format))
+        times, rows = [], []
+        for line in f:
+            if not line.endswith(b'\n'):
+                break                   # the logger is still writing this one
+            t = _csv_time(line, time_format)
+            if t > end:
+                break
+            times.append(t)
+            rows.append(next(csv.reader([line.decode()]))[1:])
+    return [name.strip() for name in header[1:]], times, rows
+
+
+def query_csv(paths, start, end, channels=None, time_format=CSV_TIME_FORMAT):
+    # like query(), for one or more mod_log CSV files
+    return query_csv_ns(paths, to_ns(start), to_ns(end), channels, time_format)
+
+
+def query_csv_ns(paths, start, end, channels=None, time_format=CSV_TIME_FORMAT):
+    # query_csv() with start and end already in ns since the epoch
+    if isinstance(paths, str):
+        paths = [paths]
+    names, times, rows = None, [], []
+    for path in paths:
+        header, t, r = _csv_window(path, start, end, time_format)
+        if names is not None and header != names:
+            raise ValueError(f'{path} has columns {header}, but {paths[0]} has {names}')
+        names = names or header
+        times += t
+        rows += r
+    names = names or []
+    if channels is None:
+        channels = names
+    columns = [names.index(name) for name in channels]
+    out = np.empty(len(times), tl.record_dtype(channels))
+    out['t'] = times
+    for name, column in zip(channels, columns):
+        out[name] = [float(row[column]) for row in rows]
+    return np.sort(out, order='t', kind='stable')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Read a time range out of the telemetry logs')
+    parser.add_argument('paths', nargs='+', help='a telemetry_log directory or mod_log CSV files')
+    parser.add_argument('--start', required=True, help='ISO time (local) or epoch seconds')
+    parser.add_argument('--end', help='ISO time (local) or epoch seconds')
+    parser.add_argument('--minutes', type=float, help='length of the window instead of --end')
+    parser.add_argument('--channels', nargs='+', help='channels to return (default all)')
+    parser.add_argument('--prefix', help='only segments written with this prefix')
+    parser.add_argument('--out', help='save the arrays to this .npz instead of printing CSV')
+    args = parser.parse_args(argv)
+
+    start = to_ns(args.start)
+    if args.end is not None:
+        end = to_ns(args.end)
+    elif args.minutes is not None:
+        end = start + int(round(args.minutes * 60e9))
+    else:
+        parser.error('give --end or --minutes')
+
+    t0 = time.perf_counter()
+    try:
+        if len(args.paths) == 1 and os.path.isdir(args.paths[0]):
+            records = query_ns(args.paths[0], start, end, args.channels, args.prefix)
+        else:
+            records = query_csv_ns(args.paths, start, end, args.channels)
+    except ValueError as e:
+        parser.exit(1, f'{e}\n')
+    elapsed = time.perf_counter() - t0
+    print(f'{len(records)} records in {elapsed * 1e3:.1f} ms', file=sys.stderr)
+
+    if args.out:
+        np.savez(args.out, **{name: records[name] for name in records.dtype.names})
+    else:
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow(records.dtype.names)
+        for record in records:
+            writer.writerow(record.tolist())
+        sys.stdout.write(text.getvalue())
+
+
+if __name__ == '__main__':
+    main()
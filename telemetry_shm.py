@@ -0,0 +1,207 @@
+#######################################################################
+# Latest module snapshots and RTD temperatures in shared memory
+#######################################################################
+
+# The process that owns the buses (bus_daemon.py, or a script that reads
+# them itself) appends a TelemetryShm to power_supply.publishers and to
+# larpix_monitor_vac_pressure.publishers. Every snapshot() and
+# read_tempers() result is then copied into a multiprocessing.shared_memory
+# block. Any number of local readers attach to the block by name and read
+# the newest values with no bus transaction and no system call after the
+# attach. The one exception is a reader that collides with a write: it
+# yields the CPU once before retrying.
+#
+# Layout, little-endian, fixed:
+#
+#   header   8s magic, u32 version, u32 module slots, u32 RTDs,
+#            u32 writer pid                                              24 bytes
+#   module   per page 1..slots: u64 seq, f64 t, temp, voltage, current,
+#            power, u32 status, 4 pad                                    56 bytes each
+#   rtd      u64 seq, f64 t, one f64 per RTD (K)
+#
+# t is time.monotonic() of the writer. It is system-wide on Linux, so a
+# reader's time.monotonic() - t is the age of the sample.
+#
+# Each slot is a seqlock. The writer makes seq odd, writes the payload, and
+# makes seq even again. A reader retries while seq is odd or changes during
+# its read, so it never returns a half-written sample. seq 0 means the slot
+# has never been written. There must be one writing process per block; the
+# threads inside it share a lock. A new writer takes over an existing block
+# only when the pid in its header is no longer running, and refuses
+# (FileExistsError) otherwise.
+#
+# Python cannot issue memory barriers, so nothing here guarantees that
+# another process sees the three stores (seq, payload, seq) in program
+# order. x86 keeps stores in order, but the Pi's ARM cores are weakly
+# ordered and may not. What makes it work in practice is that each store is
+# a separate struct.pack_into call. Between those calls the interpreter
+# runs a lot of code, including the atomic operations of its own locking,
+# and on ARM those act as barriers. That is an observed property of
+# CPython, not a promise.
+#
+#   python telemetry_shm.py --interval 1         # print the newest values
+
+import argparse
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from supper_supp_modules import ModuleSnapshot
+
+DEFAULT_NAME = 'power_supply_telemetry'
+MAGIC = b'PSTELEM\0'
+VERSION = 2
+
+HEADER = struct.Struct('<8sIIII')
+SEQ = struct.Struct('<Q')
+MODULE = struct.Struct('<dddddI4x')
+MODULE_SLOT = SEQ.size + MODULE.size
+
+
+class TelemetryShm:
+
+    def __init__(self, name=DEFAULT_NAME, create=False, slots=8, rtds=4):
+        if create:
+            self.rtd = struct.Struct('<d' + 'd' * rtds)
+            size = HEADER.size + slots * MODULE_SLOT + SEQ.size + self.rtd.size
+            try:
+                self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:
+                # only take over a block left behind by a writer that is gone
+                stale = attach(name)
+                try:
+                    if stale.size < HEADER.size:
+                        raise FileExistsError(f'shared memory {name!r} exists and is not a telemetry block')
+                    magic, version, _, _, pid = HEADER.unpack_from(stale.buf, 0)
+                    if magic != MAGIC or version != VERSION:
+                        raise FileExistsError(f'shared memory {name!r} exists and is not a version {VERSION} telemetry block')
+                    if process_alive(pid):
+                        raise FileExistsError(f'shared memory {name!r} is in use by process {pid}')
+                    stale.unlink()
+                finally:
+                    stale.close()
+                self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            self.shm.buf[:size] = bytes(size)
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, slots, rtds, os.getpid())
+        else:
+            self.shm = attach(name)
+            magic, version, slots, rtds, _ = HEADER.unpack_from(self.shm.buf, 0)
+            if magic != MAGIC or version != VERSION:
+                self.shm.close()
+                raise ValueError(f'shared memory {name!r} is not a version {VERSION} telemetry block')
+            self.rtd = struct.Struct('<d' + 'd' * rtds)
+        self.name = name
+        self.owner = create
+        self.slots = slots
+        self.rtds = rtds
+        self.rtd_offset = HEADER.size + slots * MODULE_SLOT
+        self.lock = threading.Lock()
+
+    # writer side: the publisher hooks
+    def _write(self, offset, payload, values):
+        buf = self.shm.buf
+        with self.lock:
+            seq, = SEQ.unpack_from(buf, offset)
+            SEQ.pack_into(buf, offset, seq + 1)             # odd: write in progress
+            payload.pack_into(buf, offset + SEQ.size, *values)
+            SEQ.pack_into(buf, offset, seq + 2)
+
+    def publish_snapshot(self, snap):
+        if not 1 <= snap.page <= self.slots:
+            return
+        offset = HEADER.size + (snap.page - 1) * MODULE_SLOT
+        self._write(offset, MODULE, (snap.t, snap.temp, snap.voltage, snap.current, snap.power, snap.status))
+
+    def publish_tempers(self, temperatures, t=None):
+        values = list(temperatures)[:self.rtds]
+        values += [float('nan')] * (self.rtds - len(values))
+        self._write(self.rtd_offset, self.rtd, [time.monotonic() if t is None else t] + values)
+
+    # reader side
+    def _read(self, offset, payload, retries=10000):
+        buf = self.shm.buf
+        for _ in range(retries):
+            seq, = SEQ.unpack_from(buf, offset)
+            if not seq & 1:
+                values = payload.unpack_from(buf, offset + SEQ.size)
+                if SEQ.unpack_from(buf, offset)[0] == seq:
+                    return seq, values
+            time.sleep(0)       # collided with the writer: let it finish
+        raise TimeoutError('telemetry slot kept changing while being read')
+
+    def read_snapshot(self, page):
+        # the newest ModuleSnapshot of a page, None if none was published
+        if not 1 <= page <= self.slots:
+            raise ValueError(f'page {page} is outside 1..{self.slots}')
+        seq, values = self._read(HEADER.size + (page - 1) * MODULE_SLOT, MODULE)
+        if not seq:
+            return None
+        t, temp, voltage, current, power, status = values
+        return ModuleSnapshot(page, t, temp, voltage, current, power, status)
+
+    def read_tempers(self):
+        # (t, [K per RTD]) of the newest read_tempers, None if none was published
+        seq, values = self._read(self.rtd_offset, self.rtd)
+        if not seq:
+            return None
+        return values[0], list(values[1:])
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True         # alive, just not ours to signal
+    return True
+
+
+def attach(name):
+    # a reader must not let the resource tracker unlink the writer's block
+    # when the reader exits (Python < 3.13 registers every attach)
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print the newest telemetry from shared memory')
+    parser.add_argument('--name', default=DEFAULT_NAME)
+    parser.add_argument('--interval', type=float, help='keep printing every this many seconds')
+    args = parser.parse_args(argv)
+
+    shm = TelemetryShm(args.name)
+    try:
+        while True:
+            now = time.monotonic()
+            for page in range(1, shm.slots + 1):
+                snap = shm.read_snapshot(page)
+                if snap is not None:
+                    print(f'Module {page}: {snap.temp} °C, {snap.voltage:.3f} V, {snap.current:.3f} A,'
+                          f' {snap.power:.3f} W, status {snap.status:#06x} ({now - snap.t:.1f} s old)')
+            rtd = shm.read_tempers()
+            if rtd is not None:
+                print('RTDs: ' + ', '.join(f'{k:.2f} K' for k in rtd[1]) + f' ({now - rtd[0]:.1f} s old)')
+            if args.interval is None:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shm.close()
+
+
+if __name__ == '__main__':
+    main()
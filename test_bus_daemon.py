@@ -0,0 +1,192 @@
+#######################################################################
+# bus_daemon.py against the simulated buses
+#######################################################################
+
+# Run with python -m pytest test_bus_daemon.py. Queued jobs are held back
+# by parking the PMBus worker on an Event, so the tests can line up reads
+# and writes deterministically before any of them reach the device.
+
+import threading
+import time
+
+import pytest
+
+import bus_worker
+import larpix_monitor_vac_pressure as lmp
+from bus_daemon import BusClient, BusDaemon, BusDaemonError, BusServer
+from simulated_bus import SimulatedAD7124, SimulatedPMBus
+from supper_supp_modules import power_supply
+
+
+@pytest.fixture
+def bus():
+    return SimulatedPMBus(latency=0.0005)
+
+
+@pytest.fixture
+def daemon(bus, monkeypatch, tmp_path):
+    monkeypatch.setattr(lmp, 'spi', SimulatedAD7124())
+    lmp.init_registers(fingerprint_path=str(tmp_path / 'ad7124_fingerprint.json'))
+    daemon = BusDaemon(power_supply(0x50, bus=bus), lmp)
+    yield daemon
+    daemon.stop()
+
+
+@pytest.fixture
+def server(daemon, tmp_path):
+    path = str(tmp_path / 'bus.sock')
+    server = BusServer(path, daemon)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+def hold(daemon):
+    # park the PMBus worker until the returned Event is set
+    gate = threading.Event()
+    daemon.pmbus.submit(bus_worker.CONTROL, gate.wait)
+    return gate
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+
+def test_on_off_on_leaves_the_module_on(daemon, bus):
+    gate = hold(daemon)
+    futures = [daemon.write('on', 4), daemon.write('off', 4), daemon.write('on', 4)]
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert bus.modules[4]['operation'] == 0x80
+    assert daemon.counts['merged_writes'] == 2
+
+
+def test_off_on_off_leaves_the_module_off(daemon, bus):
+    bus.modules[4]['operation'] = 0x80
+    gate = hold(daemon)
+    futures = [daemon.write('off', 4), daemon.write('on', 4), daemon.write('off', 4)]
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert bus.modules[4]['operation'] == 0x00
+
+
+def test_writes_merge_only_with_the_newest_write_to_the_page(daemon, bus):
+    gate = hold(daemon)
+    futures = [daemon.write('set_voltage', 4, 5.0),
+               daemon.write('set_voltage', 4, 7.0),     # merges into 5.0
+               daemon.write('off', 4),
+               daemon.write('set_voltage', 4, 12.0),    # a write to OPERATION is between
+               daemon.write('set_voltage', 3, 9.0)]     # another page
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    assert daemon.counts['merged_writes'] == 1
+    assert bus.modules[4]['vout_command'] == 12 * 256
+    assert bus.modules[4]['operation'] == 0x00
+    assert bus.modules[3]['vout_command'] == 9 * 256
+
+
+def test_write_after_a_batch_is_not_merged_ahead_of_it(daemon, bus):
+    gate = hold(daemon)
+    first = daemon.write('set_voltage', 4, 10.0)
+    batch = threading.Thread(target=daemon.batch, args=([{'op': 'set_voltage', 'page': 4, 'voltage': 11.0}],))
+    batch.start()
+    wait_for(lambda: daemon.counts['bus_jobs'] == 2)
+    last = daemon.write('set_voltage', 4, 12.0)
+    gate.set()
+    first.result(timeout=5)
+    last.result(timeout=5)
+    batch.join(5)
+    assert daemon.counts['merged_writes'] == 0
+    assert bus.modules[4]['vout_command'] == 12 * 256
+
+
+def test_write_after_its_job_started_is_not_merged(daemon, bus):
+    daemon.write('set_voltage', 4, 5.0).result(timeout=5)
+    daemon.write('set_voltage', 4, 6.0).result(timeout=5)
+    assert daemon.counts['merged_writes'] == 0
+    assert bus.modules[4]['vout_command'] == 6 * 256
+
+
+def test_client_round_trip(server, bus):
+    client = BusClient(server)
+    try:
+        assert client.request('ping') == 'pong'
+        client.on_mod(4)
+        client.set_voltage(4, 12.0)
+        snap = client.snapshot(4)
+        assert snap.page == 4
+        assert snap.voltage == pytest.approx(12.0)
+        assert snap.power == pytest.approx(12.0 * 12.0 / bus.modules[4]['load_ohms'])
+        assert [s.page for s in client.snapshot_all([1, 2, 3, 4])] == [1, 2, 3, 4]
+        temps = client.read_tempers()
+        assert len(temps) == 4 and all(250 < t < 350 for t in temps)
+        results = client.batch([{'op': 'off', 'page': 4}, {'op': 'snapshot', 'page': 4},
+                                {'op': 'read_tempers'}, {'op': 'bogus'}])
+        assert [r['ok'] for r in results] == [True, True, True, False]
+        assert results[1]['result']['voltage'] == 0.0
+        with pytest.raises(BusDaemonError):
+            client.request('bogus')
+        assert client.request('ping') == 'pong'     # the connection survives an error
+    finally:
+        client.close()
+
+
+def test_identical_reads_share_one_bus_job(server, daemon):
+    n = 8
+    clients = [BusClient(server) for _ in range(n)]
+    results = [None] * n
+    gate = hold(daemon)
+
+    def read(i):
+        results[i] = clients[i].snapshot(4)
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: daemon.counts['requests'] == n)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    for client in clients:
+        client.close()
+    assert daemon.counts['coalesced_reads'] == n - 1
+    assert daemon.counts['bus_jobs'] == 1
+    assert all(r == results[0] for r in results)
+
+
+def test_queued_writes_from_several_clients_keep_their_order(server, daemon, bus):
+    clients = [BusClient(server) for _ in range(3)]
+    gate = hold(daemon)
+    threads = []
+    for i, op in enumerate(['on_mod', 'off_mod', 'on_mod']):
+        threads.append(threading.Thread(target=getattr(clients[i], op), args=(4,)))
+        threads[-1].start()
+        wait_for(lambda: daemon.counts['requests'] == i + 1)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    for client in clients:
+        client.close()
+    assert bus.modules[4]['operation'] == 0x80
+
+
+def test_server_refuses_a_live_socket(server, daemon):
+    with pytest.raises(BusDaemonError):
+        BusServer(server, daemon)
+
+
+def test_read_tempers_without_an_adc(bus):
+    daemon = BusDaemon(power_supply(0x50, bus=bus))
+    try:
+        with pytest.raises(BusDaemonError):
+            daemon.handle({'op': 'read_tempers'})
+    finally:
+        daemon.stop()
@@ -0,0 +1,61 @@
+#######################################################################
+# metrics_exporter.py scraped over HTTP
+#######################################################################
+
+# Run with python -m pytest test_metrics_exporter.py. The cache is filled by
+# hand and served on a free port, so no bus is involved.
+
+import math
+import time
+import urllib.request
+
+import pytest
+
+from metrics_exporter import CONTENT_TYPE, MetricsCache, serve
+from supper_supp_modules import ModuleSnapshot
+
+
+@pytest.fixture
+def cache():
+    return MetricsCache()
+
+
+@pytest.fixture
+def scrape(cache):
+    server = serve(cache, port=0)
+
+    def get():
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.headers['Content-Type'] == CONTENT_TYPE
+            return response.read().decode()
+
+    yield get
+    server.shutdown()
+    server.server_close()
+
+
+def samples(text):
+    # {'name{labels}': 'value'} for every sample line
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+
+
+def test_non_finite_values_are_spelled_the_openmetrics_way(cache, scrape):
+    cache.publish_snapshot(ModuleSnapshot(4, time.monotonic(), math.nan, 12.0, math.inf, -math.inf, 0))
+    cache.publish_tempers([math.nan, math.inf, -math.inf, 300.5])
+    cache.observe('read_tempers', math.inf)
+    text = scrape()
+    values = samples(text)
+    assert values['power_supply_module_temperature_celsius{page="4"}'] == 'NaN'
+    assert values['power_supply_module_voltage_volts{page="4"}'] == '12.0'
+    assert values['power_supply_module_current_amperes{page="4"}'] == '+Inf'
+    assert values['power_supply_module_power_watts{page="4"}'] == '-Inf'
+    assert [values[f'rtd_temperature_kelvin{{rtd="{i}"}}'] for i in range(1, 5)] == ['NaN', '+Inf', '-Inf', '300.5']
+    assert values['acquisition_latency_seconds_sum{op="read_tempers"}'] == '+Inf'
+    assert not any(v in ('nan', 'inf', '-inf') for v in values.values())
+    assert text.endswith('# EOF\n')
+
+
+def test_each_scrape_is_counted(cache, scrape):
+    scrape()
+    assert samples(scrape())['metrics_scrapes_total'] == '2'